@@ -0,0 +1,228 @@
+import random
+import smtplib
+import threading
+import time
+from collections import defaultdict, namedtuple
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import storage
+
+# ---------------------------
+# ALERT DISPATCHER
+# ---------------------------
+# Alerts that need an email are queued in alert_deliveries next to their row in
+# `alerts`. A background worker picks up due deliveries, sends one digest per
+# recipient over a single SMTP connection per batch, and records the outcome
+# (sent / retry with backoff / failed) per alert.
+COALESCE_SECONDS = 10
+POLL_SECONDS = 5
+BATCH_SIZE = 200
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 30
+BACKOFF_MAX = 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS alert_deliveries
+    (alert_id INTEGER PRIMARY KEY, recipient TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'pending',
+     attempts INTEGER NOT NULL DEFAULT 0, next_attempt_at REAL NOT NULL, last_error TEXT, sent_at REAL);
+CREATE INDEX IF NOT EXISTS idx_alert_deliveries_due ON alert_deliveries (status, next_attempt_at);
+"""
+
+SmtpConfig = namedtuple("SmtpConfig", ["server", "port", "sender", "password", "starttls"], defaults=[None, True])
+
+_installed = set()
+_install_lock = threading.Lock()
+
+
+def install(db_path=storage.DB_PATH):
+    with _install_lock:
+        if db_path not in _installed:
+            with storage.connection(db_path) as conn:
+                conn.executescript(SCHEMA)
+            _installed.add(db_path)
+
+
+def queue_alert(alert_type, message, recipient=None, db_path=storage.DB_PATH):
+    """Record an alert; with a recipient it is also queued for email delivery.
+
+    Delivery is held back for COALESCE_SECONDS so a burst of alerts reaches
+    the recipient as one digest.
+    """
+    if not recipient:
+        storage.record_alert(alert_type, message, path=db_path)
+        return
+    install(db_path)
+    # Both rows commit together, so last_insert_rowid() is the alert just inserted.
+    storage.writer(db_path).submit_group([
+        ("INSERT INTO alerts (alert_type, message) VALUES (?, ?)", (alert_type, message)),
+        ("INSERT INTO alert_deliveries (alert_id, recipient, next_attempt_at) VALUES (last_insert_rowid(), ?, ?)",
+         (recipient, time.time() + COALESCE_SECONDS)),
+    ])
+
+
+def build_digest(sender, recipient, alerts):
+    """One message for all of a recipient's pending alerts."""
+    message = MIMEMultipart()
+    message["From"] = sender
+    message["To"] = recipient
+    if len(alerts) == 1:
+        message["Subject"] = f"AgriSense {alerts[0]['alert_type'].title()} Alert"
+        body = alerts[0]["message"]
+    else:
+        message["Subject"] = f"AgriSense Alert Digest ({len(alerts)} alerts)"
+        body = "\n\n".join(f"[{a['timestamp']}] {a['alert_type'].title()}: {a['message']}" for a in alerts)
+    message.attach(MIMEText(body, "plain"))
+    return message
+
+
+class AlertDispatcher:
+    def __init__(self, config, db_path=storage.DB_PATH, batch_size=BATCH_SIZE, poll_seconds=POLL_SECONDS,
+                 max_attempts=MAX_ATTEMPTS, backoff_base=BACKOFF_BASE, smtp_factory=smtplib.SMTP):
+        self.config = config
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.smtp_factory = smtp_factory
+        self.sent = 0
+        self.failed = 0
+        self.messages_per_second = 0.0
+        install(db_path)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="agrisense-alerts", daemon=True)
+            self._thread.start()
+        return self
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self.dispatch_once() == self.batch_size:
+                    continue  # More may be due; don't wait for the next poll.
+            except Exception:
+                pass  # A bad batch must not kill the worker; its rows stay pending.
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+
+    def _due(self, now):
+        with storage.connection(self.db_path) as conn:
+            rows = conn.execute(
+                """SELECT d.alert_id, d.recipient, d.attempts, a.alert_type, a.message, a.timestamp
+                   FROM alert_deliveries d JOIN alerts a ON a.id = d.alert_id
+                   WHERE d.status = 'pending' AND d.next_attempt_at <= ?
+                   ORDER BY d.next_attempt_at LIMIT ?""",
+                (now, self.batch_size),
+            ).fetchall()
+        keys = ("alert_id", "recipient", "attempts", "alert_type", "message", "timestamp")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def _backoff(self, attempts):
+        delay = min(self.backoff_base * 2 ** (attempts - 1), BACKOFF_MAX)
+        return delay * random.uniform(0.5, 1.0)
+
+    def dispatch_once(self, now=None):
+        """Send every due delivery; returns how many alerts were handled."""
+        now = time.time() if now is None else now
+        due = self._due(now)
+        if not due:
+            return 0
+        by_recipient = defaultdict(list)
+        for alert in due:
+            by_recipient[alert["recipient"]].append(alert)
+
+        outcomes = []  # (alert, error or None)
+        started = time.perf_counter()
+        try:
+            server = self._connect()
+        except (smtplib.SMTPException, OSError) as e:
+            outcomes = [(alert, str(e)) for alert in due]
+        else:
+            try:
+                for recipient, alerts in by_recipient.items():
+                    message = build_digest(self.config.sender, recipient, alerts)
+                    try:
+                        server.sendmail(self.config.sender, [recipient], message.as_string())
+                        error = None
+                    except smtplib.SMTPServerDisconnected as e:
+                        error = str(e)
+                        server = self._connect()
+                    except smtplib.SMTPException as e:
+                        error = str(e)
+                    outcomes.extend((alert, error) for alert in alerts)
+            except (smtplib.SMTPException, OSError) as e:
+                handled = {alert["alert_id"] for alert, _ in outcomes}
+                outcomes.extend((alert, str(e)) for alert in due if alert["alert_id"] not in handled)
+            finally:
+                try:
+                    server.quit()
+                except (smtplib.SMTPException, OSError):
+                    pass
+        elapsed = time.perf_counter() - started
+        self._record(outcomes, time.time())
+        messages = len(by_recipient)
+        self.messages_per_second = messages / elapsed if elapsed else 0.0
+        return len(due)
+
+    def _connect(self):
+        server = self.smtp_factory(self.config.server, self.config.port, timeout=10)
+        if self.config.starttls:
+            server.starttls()
+        if self.config.password:
+            server.login(self.config.sender, self.config.password)
+        return server
+
+    def _record(self, outcomes, now):
+        sent, retry, failed = [], [], []
+        for alert, error in outcomes:
+            if error is None:
+                sent.append((now, alert["alert_id"]))
+                continue
+            attempts = alert["attempts"] + 1
+            if attempts >= self.max_attempts:
+                failed.append((attempts, error, alert["alert_id"]))
+            else:
+                retry.append((attempts, now + self._backoff(attempts), error, alert["alert_id"]))
+        with storage.connection(self.db_path) as conn, conn:
+            conn.executemany(
+                "UPDATE alert_deliveries SET status = 'sent', attempts = attempts + 1, sent_at = ?, last_error = NULL "
+                "WHERE alert_id = ?", sent)
+            conn.executemany(
+                "UPDATE alert_deliveries SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE alert_id = ?", retry)
+            conn.executemany(
+                "UPDATE alert_deliveries SET status = 'failed', attempts = ?, last_error = ? WHERE alert_id = ?", failed)
+        self.sent += len(sent)
+        self.failed += len(failed)
+
+    def status_counts(self):
+        with storage.connection(self.db_path) as conn:
+            return dict(conn.execute("SELECT status, COUNT(*) FROM alert_deliveries GROUP BY status").fetchall())
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher(config):
+    """The process-wide dispatcher, started on first use (restarted if the SMTP config changes)."""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None or _dispatcher.config != config:
+            if _dispatcher is not None:
+                _dispatcher.stop()
+            _dispatcher = AlertDispatcher(config).start()
+        return _dispatcher
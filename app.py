@@ -1,258 +1,255 @@
 import streamlit as st
-import speech_recognition as sr
-import pyttsx3
-import google.generativeai as genai
 import os
-from dotenv import load_dotenv
-import requests
-from PIL import Image
-import sqlite3
+import re
 import time
+import uuid
+from dotenv import load_dotenv
+import history
+import metrics
+import llm
+import market
+import storage
+import telemetry
+from llm import analyze_crop_image, analyze_crop_images, get_ai_response, stream_ai_response
+from streaming import SentenceSplitter
+
+# Voice (speech_recognition), image (imaging/PIL), TTS (tts/pyttsx3), weather
+# (requests), email (alerts) and the NumPy engines (crops, soil, knowledge) are
+# imported where their feature is used, so a plain rerun never pays for them.
+run_started = time.perf_counter()
+
+# ---------------------------
+# PAGE CONFIG (must be the first Streamlit call)
+# ---------------------------
+st.set_page_config(
+    page_title="AgriSense — AI Farming Assistant",
+    layout="wide",
+    initial_sidebar_state="expanded"
+)
 
 # ---------------------------
-# LOAD ENV FILE (for API Keys)
+# ONE-TIME INITIALIZATION (cached for the life of the process)
 # ---------------------------
-load_dotenv()
-api_key = os.getenv("GEMINI_API_KEY")
+@st.cache_resource(show_spinner=False)
+def load_settings():
+    load_dotenv()
+    return {"gemini": os.getenv("GEMINI_API_KEY"), "openweather": os.getenv("OPENWEATHER_API_KEY")}
+
+@st.cache_resource(show_spinner=False)
+def init_backends(api_key, smtp=None):
+    # Schema, connection pool and the background writer are created once per
+    # process; reads borrow a pooled connection and writes are group-committed.
+    # The Gemini SDK is configured here but only imported on the first request.
+    # With SMTP configured, the alert dispatcher starts now, so deliveries left
+    # pending by a previous process go out without waiting for a new alert.
+    storage.init_db()
+    with storage.connection() as conn:
+        # Catches counters left out of step by edits made outside the app.
+        metrics.repair(conn)
+    llm.configure(api_key)
+    if smtp is not None:
+        import alerts
+        alerts.get_dispatcher(smtp)
+    return {"runs": 0}
+
+@st.cache_resource(show_spinner=False)
+def load_css(path="style.css"):
+    with open(path, encoding="utf-8") as f:
+        css = f.read()
+    # Minified once per process, so every rerun sends the smallest possible block.
+    css = re.sub(r"\s*([{}:;,>])\s*", r"\1", re.sub(r"\s+", " ", css))
+    return f"<style>{css.strip()}</style>"
+
+settings = load_settings()
+api_key = settings["gemini"]
 if not api_key:
     st.error("GEMINI_API_KEY not found in .env file. Please set it up.")
     st.stop()
-genai.configure(api_key=api_key)
 
-weather_api_key = os.getenv("OPENWEATHER_API_KEY")
+weather_api_key = settings["openweather"]
 if not weather_api_key:
     st.warning("OPENWEATHER_API_KEY not set. Weather feature limited.")
 
-# ---------------------------
-# DATABASE SETUP
-# ---------------------------
-conn = sqlite3.connect('agrisense.db', check_same_thread=False)
-c = conn.cursor()
-
-# Create tables if not exist
-c.execute('''CREATE TABLE IF NOT EXISTS chats
-             (id INTEGER PRIMARY KEY AUTOINCREMENT, message TEXT, role TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
-c.execute('''CREATE TABLE IF NOT EXISTS alerts
-             (id INTEGER PRIMARY KEY AUTOINCREMENT, alert_type TEXT, message TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
-conn.commit()
+st.markdown(load_css(), unsafe_allow_html=True)
 
 # ---------------------------
-# TEXT-TO-SPEECH ENGINE INITIALIZATION
+# TEXT-TO-SPEECH (background worker + audio cache)
 # ---------------------------
-engine = pyttsx3.init()
-engine.setProperty('rate', 150)
-
-def speak(text):
-    try:
-        if engine._inLoop:
-            engine.endLoop()
-        engine.say(text)
-        engine.runAndWait()
-    except RuntimeError as e:
-        st.warning(f"Text-to-speech error: {str(e)}. Retrying...")
-        engine.endLoop()
-        engine.say(text)
-        engine.runAndWait()
+def speak(text, language="English"):
+    # Rendering happens on the TTS worker thread; the clip is played in the
+    # browser once ready, so the rerun never waits for speech.
+    import tts
+    st.session_state.tts_clips.append(tts.get_worker().submit(text, language))
+
+SPEECH_POLL = 0.5  # seconds between player checks while an answer's audio is rendering or playing
+
+def start_speech():
+    st.session_state.tts_clips = []
+    st.session_state.tts_queued = 0  # clips already handed to an audio element
+    st.session_state.tts_played = []  # one joined clip per batch, in playing order
+    st.session_state.tts_busy_until = 0.0  # when the last batch handed over finishes playing
+    st.session_state.tts_error = None
+
+def speech_pending():
+    state = st.session_state
+    return state.tts_queued < len(state.tts_clips) or time.monotonic() < state.tts_busy_until
+
+def play_speech():
+    # Runs as a fragment every SPEECH_POLL seconds while speech is pending, so
+    # a rerun never waits on the TTS worker. Each run hands the clips that are
+    # ready (in order) to a new audio element once the previous one has
+    # finished, so the first sentence plays while later ones still render.
+    import tts
+    state = st.session_state
+    if time.monotonic() >= state.tts_busy_until and state.tts_queued < len(state.tts_clips):
+        ready = []
+        for clip in state.tts_clips[state.tts_queued:]:
+            if not clip.done():
+                break
+            ready.append(clip)
+        if ready and ready[0].exception() is not None:
+            state.tts_error = str(ready[0].exception())
+            state.tts_queued = len(state.tts_clips)
+        elif ready:
+            ready = [clip for clip in ready if clip.exception() is None]
+            paths = [clip.result() for clip in ready]
+            joined = tts.get_worker().join(paths)
+            if joined is None:
+                ready, joined = ready[:1], paths[0]
+            state.tts_queued += len(ready)
+            state.tts_played.append(joined)
+            # One poll of slack covers the browser's delay in starting playback.
+            state.tts_busy_until = time.monotonic() + tts.clip_seconds(joined) + SPEECH_POLL
+    if state.tts_error:
+        st.caption(f"🔇 {state.tts_error}")
+    elif not state.tts_played:
+        st.caption("🔊 Preparing audio...")
+    # Batches already playing are redrawn unchanged, which leaves them playing;
+    # once everything has played they are shown without autoplay.
+    for path in state.tts_played:
+        st.audio(path, format="audio/wav", autoplay=state.tts_polling)
+    if state.tts_polling and not speech_pending():
+        st.rerun()  # a full run turns the polling off
 
 # ---------------------------
-# EMAIL FUNCTION (Optional)
+# EMAIL ALERTS (Optional, background dispatcher)
 # ---------------------------
-def send_email(to_email, subject, body):
+def smtp_config():
+    import alerts
     try:
-        smtp_server = st.secrets.get("smtp", {}).get("server")
-        smtp_port = st.secrets.get("smtp", {}).get("port")
-        sender_email = st.secrets.get("smtp", {}).get("sender")
-        sender_password = st.secrets.get("smtp", {}).get("password")
-
-        if not all([smtp_server, smtp_port, sender_email, sender_password]):
-            st.warning("Email functionality disabled: SMTP secrets not found. Check secrets.toml.")
-            return False
-
-        message = MIMEMultipart()
-        message["From"] = sender_email
-        message["To"] = to_email
-        message["Subject"] = subject
-        message.attach(MIMEText(body, "plain"))
-
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        server.starttls()
-        server.login(sender_email, sender_password)
-        server.sendmail(sender_email, to_email, message.as_string())
-        server.quit()
-        return True
-    except Exception as e:
-        st.error(f"Error sending email: {str(e)}")
-        return False
+        smtp = st.secrets.get("smtp", {})
+    except Exception:
+        return None
+    config = alerts.SmtpConfig(smtp.get("server"), smtp.get("port"), smtp.get("sender"), smtp.get("password"))
+    if not all([config.server, config.port, config.sender, config.password]):
+        return None
+    return config
 
 # ---------------------------
 # ENHANCED FUNCTIONS
 # ---------------------------
 def get_weather(city):
+    import weather
     try:
-        url = f"http://api.openweathermap.org/data/2.5/weather?q={city}&appid={weather_api_key}&units=metric"
-        response = requests.get(url)
-        data = response.json()
-        if response.status_code == 200:
-            return f"Weather in {city}: {data['weather'][0]['description']}, Temp: {data['main']['temp']}°C, Humidity: {data['main']['humidity']}%"
-        return "City not found or API error."
-    except Exception as e:
-        return f"Error fetching weather: {str(e)}"
-
-def get_crop_recommendation(season, soil_type, irrigation):
-    recommendations = {
-        "summer": {"sandy": {"crops": "Cotton, Groundnut", "pests": "Aphids, Bollworms", "irrigation": "Moderate"},
-                   "loamy": {"crops": "Maize, Rice", "pests": "Stem Borers", "irrigation": "High"}},
-        "winter": {"sandy": {"crops": "Wheat, Gram", "pests": "Rust, Aphids", "irrigation": "Low"},
-                   "loamy": {"crops": "Potato, Mustard", "pests": "Blights", "irrigation": "Moderate"}},
-        "monsoon": {"sandy": {"crops": "Millets, Pulses", "pests": "Leafhoppers", "irrigation": "Minimal"},
-                    "loamy": {"crops": "Paddy, Sugarcane", "pests": "Sheath Blight", "irrigation": "High"}}
-    }
-    rec = recommendations.get(season.lower(), {}).get(soil_type.lower(), {})
-    if rec:
-        return f"Crops: {rec['crops']}\nPests: {rec['pests']}\nIrrigation: {rec['irrigation']} (adjust based on {irrigation.lower()})"
+        return weather.format_weather(weather.get_service(weather_api_key).get(city))
+    except weather.WeatherError as e:
+        return str(e)
+
+def get_crop_recommendation(season, soil_type, irrigation, nitrogen=None, phosphorus=None, potassium=None):
+    import crops
+    ranked = crops.get_engine().recommend(season, soil_type, irrigation, nitrogen=nitrogen, phosphorus=phosphorus,
+                                          potassium=potassium, top=3)
+    if ranked:
+        pests = ", ".join(dict.fromkeys(p.strip() for r in ranked for p in r["pests"].split(",")))
+        return f"Crops: {', '.join(r['crop'] for r in ranked)}\nPests: {pests}\nIrrigation: {ranked[0]['irrigation']} (adjust based on {irrigation.lower()})"
     return "General recommendation: Consult local expert."
 
 def analyze_soil_health(nitrogen, phosphorus, potassium):
-    health = "Healthy" if all(x > 20 for x in [nitrogen, phosphorus, potassium]) else "Needs Improvement"
-    return f"Soil Health: {health}\nNitrogen: {nitrogen}%, Phosphorus: {phosphorus}%, Potassium: {potassium}%\nAdvice: {'Add organic manure' if health == 'Needs Improvement' else 'Maintain current practices'}"
-
-def analyze_crop_image(uploaded_file, language):
-    try:
-        model = genai.GenerativeModel("gemini-1.5-flash")
-        image = Image.open(uploaded_file)
-        prompt = f"Analyze this crop image for diseases, pests, or issues. Provide detailed diagnosis, remedies, and prevention tips as AgriSense. Respond in {language}."
-        response = model.generate_content([prompt, image])
-        return response.text
-    except Exception as e:
-        return f"Error analyzing image: {str(e)}"
+    import soil
+    result = soil.analyze_sample(nitrogen, phosphorus, potassium)
+    return f"Soil Health: {result['health']}\nNitrogen: {nitrogen}%, Phosphorus: {phosphorus}%, Potassium: {potassium}%\nAdvice: {soil.ADVICE[result['advice_code']]}"
+
+def prepare_upload(uploaded):
+    from imaging import prepare_image
+    prepared = st.session_state.setdefault("prepared_images", {})
+    if uploaded.file_id not in prepared:
+        if len(prepared) >= 20:
+            prepared.clear()
+        prepared[uploaded.file_id] = prepare_image(uploaded)
+    return prepared[uploaded.file_id]
 
 def get_market_price(crop):
+    summary = market.get_store().summary(crop)
+    if summary:
+        return f"Market Price for {summary}"
     return f"Market Price for {crop}: Approx. ₹50/kg (Check local markets for real-time data)"
 
-def get_ai_response(prompt, language):
+OFFLINE_NO_MATCH = "📴 Offline Mode: no matching entry in the local knowledge base. Try naming the crop and problem, e.g. 'rice blast'."
+
+def local_answer(prompt, language, offline):
+    # Confident knowledge-base hits skip Gemini; the KB remedies are English, so
+    # other languages only use them when offline. Offline mode never calls Gemini.
+    import knowledge
+    index = knowledge.get_index()
+    match = index.best_answer(prompt)
+    if index.error:
+        st.warning(f"Knowledge base update rejected, still using the last good version: {index.error}")
+    if match and (offline or language == "English"):
+        return knowledge.format_answer(match)
+    if offline:
+        return OFFLINE_NO_MATCH
+    return None
+
+def assemble_context(prompt):
+    # Recent turns, a rolling summary of older ones and reference lines, within a token budget.
+    import conversation
+    return conversation.get_assembler().assemble(
+        prompt, st.session_state.session_id, st.session_state.get("history_newest_id"),
+        market.get_store().context_for(prompt))
+
+def answer_question(prompt, language, offline):
+    local = local_answer(prompt, language, offline)
+    if local:
+        return local
+    context = assemble_context(prompt)
+    return get_ai_response(prompt, language, context=context.references, summary=context.summary, turns=context.turns)
+
+def stream_answer(prompt, language, offline):
+    local = local_answer(prompt, language, offline)
+    if local:
+        yield local
+    else:
+        context = assemble_context(prompt)
+        yield from stream_ai_response(prompt, language, context=context.references, summary=context.summary, turns=context.turns)
+
+def save_chats():
+    # Waits for this run's chat rows; a failed write is kept in the session and
+    # shown above the chat after the rerun, instead of vanishing silently.
     try:
-        model = genai.GenerativeModel("gemini-1.5-flash")
-        response = model.generate_content(
-            f"You are AgriSense, an advanced AI farming assistant. Provide detailed, expert advice on crops, weather impacts, soil health, pest control, market trends, and general agriculture queries. Include practical remedies and local context (e.g., India, 09:40 PM IST, Sep 15, 2025). Respond in {language} with a friendly, authoritative tone.\nUser: {prompt}"
-        )
-        return response.text
-    except Exception as e:
-        return f"⚠️ Error: {str(e)}"
+        storage.flush()
+    except storage.WriteFailed as e:
+        st.session_state.save_error = str(e)
 
-# ---------------------------
-# CUSTOM CSS FOR ENHANCED AESTHETICS
-# ---------------------------
-st.markdown("""
-    <style>
-    .stApp {
-        background: linear-gradient(135deg, #00C9FF 0%, #92FE9D 100%);
-        font-family: 'Arial', sans-serif;
-        color: black;
-        animation: fadeIn 1s ease-in;
-    }
-    @keyframes fadeIn {
-        from { opacity: 0; }
-        to { opacity: 1; }
-    }
-    .user-message {
-        background-color: #FF9F55;
-        color: black;
-        padding: 15px;
-        border-radius: 20px;
-        margin: 10px;
-        max-width: 80%;
-        box-shadow: 4px 4px 10px rgba(0,0,0,0.2);
-        font-size: 16px;
-    }
-    .assistant-message {
-        background-color: #6A1B9A;
-        color: white;
-        padding: 15px;
-        border-radius: 20px;
-        margin: 10px;
-        max-width: 80%;
-        box-shadow: 4px 4px 10px rgba(0,0,0,0.2);
-        font-size: 16px;
-    }
-    .stTextArea > div > div > textarea, .stChatInput > div > div > textarea {
-        border: 2px solid #FF9F55;
-        border-radius: 15px;
-        padding: 20px;
-        color: black;
-        background-color: white;
-        font-size: 18px;
-        height: 150px;
-        width: 100%;
-    }
-    .stButton > button {
-        background: linear-gradient(135deg, #FF9F55, #6A1B9A);
-        color: white;
-        border-radius: 15px;
-        padding: 12px 24px;
-        font-size: 16px;
-        box-shadow: 2px 2px 5px rgba(0,0,0,0.2);
-        transition: transform 0.3s;
-    }
-    .stButton > button:hover {
-        background: linear-gradient(135deg, #6A1B9A, #FF9F55);
-        transform: scale(1.05);
-        color: white;
-    }
-    h1, h3 {
-        color: #FFD700;
-        text-shadow: 2px 2px 4px rgba(0,0,0,0.3);
-    }
-    p {
-        color: black;
-        font-size: 16px;
-    }
-    .feature-card {
-        background-color: rgba(255, 255, 255, 0.85);
-        padding: 20px;
-        border-radius: 15px;
-        margin: 10px 0;
-        box-shadow: 0 4px 8px rgba(0,0,0,0.1);
-        transition: transform 0.3s;
-    }
-    .feature-card:hover {
-        transform: scale(1.02);
-    }
-    .dashboard-metric {
-        background-color: rgba(106, 27, 154, 0.8);
-        color: white;
-        padding: 10px;
-        border-radius: 10px;
-        margin: 5px;
-        text-align: center;
-    }
-    </style>
-""", unsafe_allow_html=True)
-
-# ---------------------------
-# PAGE CONFIG
-# ---------------------------
-st.set_page_config(
-    page_title="AgriSense — AI Farming Assistant",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
+process = init_backends(api_key, smtp_config())
+process["runs"] += 1
 
 # ---------------------------
 # INITIALIZE SESSION STATE
-if "messages" not in st.session_state:
-    st.session_state.messages = []
-
-# Load chat history from DB (general, no user-specific)
-c.execute("SELECT role, message FROM chats ORDER BY timestamp ASC")
-st.session_state.messages = [{"role": row[0], "content": row[1]} for row in c.fetchall()]
-
-# Dashboard metrics (aggregate for all interactions)
-c.execute("SELECT COUNT(*) FROM chats WHERE role = 'assistant'")
-queries_solved = c.fetchone()[0]
-c.execute("SELECT COUNT(*) FROM alerts")
-weather_alerts = c.fetchone()[0]
-c.execute("SELECT COUNT(DISTINCT DATE(timestamp)) FROM chats")  # Approx users by unique days
-users_today = c.fetchone()[0]
+# Load chat history from DB (general, no user-specific): latest page on first
+# run, afterwards only the rows added since the last cursor
+with storage.connection() as conn:
+    history.sync(st.session_state, conn)
+# Chats are shown to everyone, but each browser session keeps its own
+# conversation context for Gemini.
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
+# Dashboard metrics (aggregate for all interactions), read from the trigger-maintained rollup
+with storage.connection() as conn:
+    totals = metrics.read_totals(conn)
+queries_solved = totals["queries_solved"]
+weather_alerts = totals["weather_alerts"]
+users_today = totals["active_days"]  # Approx users by unique days
 
 # ---------------------------
 # DASHBOARD
@@ -273,44 +270,95 @@ st.sidebar.title("🌾 AgriSense Control Panel")
 st.sidebar.markdown("### Quick Tools")
 enable_email = st.sidebar.checkbox("Enable Email Alerts (Requires secrets.toml)", value=False)
 enable_tts = st.sidebar.checkbox("Enable Text-to-Speech", value=True)  # New TTS toggle
+stream_replies = st.sidebar.checkbox("Stream Responses", value=True)
 if st.sidebar.button("🌤️ Weather"):
     city = st.sidebar.text_input("City:", "Mumbai")
-    weather = get_weather(city)
-    st.sidebar.info(weather)
-    if weather.startswith("Weather"):
-        c.execute("INSERT INTO alerts (alert_type, message) VALUES ('weather', ?)", (weather,))
-        conn.commit()
-        if enable_email and send_email("default@example.com", "Weather Alert", weather):
-            st.sidebar.success("Weather alert emailed!")
+    weather_report = get_weather(city)
+    st.sidebar.info(weather_report)
+    if weather_report.startswith("Weather"):
+        config = smtp_config() if enable_email else None
+        if config:
+            import alerts
+            alerts.queue_alert("weather", weather_report, recipient="default@example.com")
+            alerts.get_dispatcher(config)
+            st.sidebar.success("Weather alert queued for email.")
         else:
+            storage.record_alert("weather", weather_report)
             st.sidebar.warning("Email not sent. Enable email alerts and configure secrets.toml.")
 
 st.sidebar.markdown("### Crop & Soil Tools")
 season = st.sidebar.selectbox("Season:", ["Summer", "Winter", "Monsoon"])
-soil = st.sidebar.selectbox("Soil Type:", ["Sandy", "Loamy", "Clayey"])
+soil_type = st.sidebar.selectbox("Soil Type:", ["Sandy", "Loamy", "Clayey"])
 irr = st.sidebar.selectbox("Irrigation:", ["Low", "Moderate", "High"])
+# The N/P/K inputs come before both buttons: a clicked button's rerun only
+# sees widgets already drawn above it.
+n = st.sidebar.number_input("Nitrogen %", 0, 100, 30)
+p = st.sidebar.number_input("Phosphorus %", 0, 100, 30)
+k = st.sidebar.number_input("Potassium %", 0, 100, 30)
 if st.sidebar.button("Crop Advice"):
-    rec = get_crop_recommendation(season, soil, irr)
+    rec = get_crop_recommendation(season, soil_type, irr, n, p, k)
     st.sidebar.success(rec)
 
 st.sidebar.markdown("### Soil Health")
-n = st.sidebar.number_input("Nitrogen %", 0, 100, 30)
-p = st.sidebar.number_input("Phosphorus %", 0, 100, 30)
-k = st.sidebar.number_input("Potassium %", 0, 100, 30)
 if st.sidebar.button("Analyze Soil"):
     health = analyze_soil_health(n, p, k)
     st.sidebar.info(health)
+soil_csv = st.sidebar.file_uploader("Bulk lab results (CSV)", type=["csv"], key="soil_csv")
+if soil_csv is not None and st.sidebar.button("Analyze Soil CSV"):
+    import soil
+    throughput = st.sidebar.empty()
+    try:
+        summary = soil.analyze_csv(soil_csv, on_chunk=lambda chunk: throughput.caption(
+            f"Chunk of {chunk['rows']} rows at {chunk['rows_per_second']:,.0f} rows/s"))
+        st.sidebar.success(
+            f"Analyzed {summary['rows']} samples in {summary['seconds']:.2f}s (batch {summary['batch_id']})\n\n"
+            f"Healthy: {summary['Healthy']}, Needs Improvement: {summary['Needs Improvement']}, Invalid: {summary['Invalid']}")
+    except ValueError as e:
+        st.sidebar.error(str(e))
 
 st.sidebar.markdown("### Market Prices")
-crop = st.sidebar.selectbox("Crop:", ["Rice", "Wheat", "Cotton"])
+crop = st.sidebar.selectbox("Crop:", market.get_store().crops() or ["Rice", "Wheat", "Cotton"])
 if st.sidebar.button("Check Price"):
     price = get_market_price(crop)
     st.sidebar.warning(price)
+price_csv = st.sidebar.file_uploader("Import mandi price history (CSV)", type=["csv"], key="price_csv")
+if price_csv is not None and st.sidebar.button("Import Prices"):
+    try:
+        loaded, skipped = market.get_store().ingest_csv(price_csv)
+        st.sidebar.success(f"Imported {loaded} price rows ({skipped} skipped).")
+    except ValueError as e:
+        st.sidebar.error(str(e))
 
 st.sidebar.markdown("### Settings")
 offline_mode = st.sidebar.checkbox("Offline Mode (Limited Features)")
 language = st.sidebar.selectbox("Language:", ["English", "Malayalam", "Hindi", "Telugu"])
 
+st.sidebar.markdown("### Admin")
+if st.sidebar.checkbox("Show Latency (p50/p95)"):
+    recorder = telemetry.get_recorder()
+    recorder.flush()
+    save_chats()
+    rows = telemetry.summarize(recorder.stored())
+    if rows:
+        st.sidebar.table([{"Stage": stage, "Calls": count, "p50 ms": f"{p50:.1f}", "p95 ms": f"{p95:.1f}"}
+                          for stage, count, p50, p95 in rows])
+    else:
+        st.sidebar.caption("No timings recorded yet.")
+    if st.sidebar.button("Verify Dashboard Counters"):
+        with storage.connection() as conn:
+            drift = metrics.repair(conn)
+        if drift:
+            st.sidebar.warning("Rebuilt dashboard counters: " + ", ".join(
+                f"{name} {rollup} → {raw}" for name, (rollup, raw) in drift.items()))
+        else:
+            st.sidebar.success("Dashboard counters match the chat and alert tables.")
+    from gateway import get_gateway
+    gateway = get_gateway().stats()
+    st.sidebar.caption(
+        f"Gemini gateway: {gateway['queue_depth']} queued, {gateway['active']} active, "
+        f"{gateway['coalesced']} coalesced, {gateway['throttled']} throttled (429), "
+        f"wait avg {gateway['wait_ms_avg']:.0f} ms / max {gateway['wait_ms_max']:.0f} ms")
+
 # ---------------------------
 # HEADER
 # ---------------------------
@@ -342,17 +390,32 @@ with col4:
 # IMAGE UPLOAD SECTION
 # ---------------------------
 st.subheader("📷 Upload Crop Image for Analysis")
-uploaded_file = st.file_uploader("Choose an image...", type=["jpg", "png", "jpeg"], key="image_uploader")
-if uploaded_file is not None and "image_processed" not in st.session_state:
-    image = Image.open(uploaded_file)
-    st.image(image, caption="Uploaded Image", use_column_width=True)
-    if st.button("Analyze Image"):
-        analysis = analyze_crop_image(uploaded_file, language)
-        st.markdown(f'<div class="assistant-message">{analysis}</div>', unsafe_allow_html=True)
-        c.execute("INSERT INTO chats (message, role) VALUES (?, 'assistant')", (analysis,))
-        conn.commit()
+uploaded_files = st.file_uploader("Choose one or more images...", type=["jpg", "png", "jpeg"], accept_multiple_files=True, key="image_uploader")
+prepared = []
+if uploaded_files and "image_processed" not in st.session_state:
+    # Each upload is decoded and downscaled once; the same prepared image is
+    # shown here and sent to Gemini.
+    try:
+        prepared = [prepare_upload(f) for f in uploaded_files]
+    except Exception as e:
+        st.error(f"Could not read image: {str(e)}")
+if prepared:
+    if len(prepared) == 1:
+        st.image(prepared[0].image, caption="Uploaded Image", use_column_width=True)
+    else:
+        st.image([p.image for p in prepared], caption=[f.name for f in uploaded_files], width=160)
+    if st.button("Analyze Image" if len(prepared) == 1 else f"Analyze {len(prepared)} Images"):
+        analyses = analyze_crop_images(prepared, language)
+        if len(analyses) > 1:
+            analyses = [f"**{f.name}**: {a}" for f, a in zip(uploaded_files, analyses)]
         if enable_tts:
-            speak(analysis)
+            start_speech()
+        for analysis in analyses:
+            st.markdown(f'<div class="assistant-message">{analysis}</div>', unsafe_allow_html=True)
+            storage.record_chat("assistant", analysis, session_id=st.session_state.session_id)
+            if enable_tts:
+                speak(analysis, language)
+        save_chats()
         st.session_state.image_processed = True
         st.rerun()
 
@@ -360,19 +423,19 @@ if uploaded_file is not None and "image_processed" not in st.session_state:
 # CHAT DISPLAY
 # ---------------------------
 st.subheader("💬 AI Chat Assistant")
+if st.session_state.get("save_error"):
+    st.error(f"⚠️ Some messages could not be saved: {st.session_state.pop('save_error')}")
+if st.session_state.history_has_more and st.button("⬆️ Load earlier messages"):
+    with storage.connection() as conn:
+        history.load_earlier(st.session_state, conn)
+chat_html = []
 for message in st.session_state.messages:
     if message["role"] == "user":
-        st.markdown(f"""
-        <div style="text-align: right;">
-            <div class="user-message">{message["content"]}</div>
-        </div>
-        """, unsafe_allow_html=True)
+        chat_html.append(f'<div style="text-align: right;"><div class="user-message">{message["content"]}</div></div>')
     else:
-        st.markdown(f"""
-        <div style="text-align: left;">
-            <div class="assistant-message">{message["content"]}</div>
-        </div>
-        """, unsafe_allow_html=True)
+        chat_html.append(f'<div style="text-align: left;"><div class="assistant-message">{message["content"]}</div></div>')
+st.markdown("\n".join(chat_html), unsafe_allow_html=True)
+speech_area = st.container()
 
 # ---------------------------
 # SINGLE INPUT AREA (Grok-like)
@@ -384,6 +447,7 @@ with col_input:
 
 with col_voice:
     if st.button("🎤"):
+        import speech_recognition as sr
         recognizer = sr.Recognizer()
         with sr.Microphone() as source:
             st.info("Listening...")
@@ -401,27 +465,45 @@ with col_file:
     uploaded_chat_file = st.file_uploader("", type=["jpg", "png", "jpeg", "pdf"], key="chat_file")
 
 if user_input:
-    st.session_state.messages.append({"role": "user", "content": user_input})
-    c.execute("INSERT INTO chats (message, role) VALUES (?, 'user')", (user_input,))
-    conn.commit()
-    reply = get_ai_response(user_input, language)
-    st.session_state.messages.append({"role": "assistant", "content": reply})
-    c.execute("INSERT INTO chats (message, role) VALUES (?, 'assistant')", (reply,))
-    conn.commit()
-    if enable_tts:
-        speak(reply)
+    storage.record_chat("user", user_input, session_id=st.session_state.session_id)
+    if stream_replies:
+        # Render tokens as they arrive and speak each sentence once it is complete;
+        # the message is saved once, after the stream ends.
+        st.markdown(f'<div style="text-align: right;"><div class="user-message">{user_input}</div></div>', unsafe_allow_html=True)
+        placeholder = st.empty()
+        splitter = SentenceSplitter()
+        parts = []
+        if enable_tts:
+            start_speech()
+        for chunk in stream_answer(user_input, language, offline_mode):
+            parts.append(chunk)
+            placeholder.markdown(f'<div style="text-align: left;"><div class="assistant-message">{"".join(parts)} ▌</div></div>', unsafe_allow_html=True)
+            if enable_tts:
+                for sentence in splitter.feed(chunk):
+                    speak(sentence, language)
+        reply = "".join(parts)
+        placeholder.markdown(f'<div style="text-align: left;"><div class="assistant-message">{reply}</div></div>', unsafe_allow_html=True)
+        if enable_tts:
+            for sentence in splitter.flush():
+                speak(sentence, language)
+    else:
+        reply = answer_question(user_input, language, offline_mode)
+        if enable_tts:
+            start_speech()
+            speak(reply, language)
+    storage.record_chat("assistant", reply, session_id=st.session_state.session_id)
+    save_chats()
     st.rerun()
 
 if uploaded_chat_file and "file_processed" not in st.session_state:
     if uploaded_chat_file.type in ["image/jpeg", "image/png"]:
         analysis = analyze_crop_image(uploaded_chat_file, language)
-        st.session_state.messages.append({"role": "user", "content": "Uploaded image for analysis"})
-        st.session_state.messages.append({"role": "assistant", "content": analysis})
-        c.execute("INSERT INTO chats (message, role) VALUES (?, 'user')", ("Uploaded image",))
-        c.execute("INSERT INTO chats (message, role) VALUES (?, 'assistant')", (analysis,))
-        conn.commit()
+        storage.record_chat("user", "Uploaded image", session_id=st.session_state.session_id)
+        storage.record_chat("assistant", analysis, session_id=st.session_state.session_id)
         if enable_tts:
-            speak(analysis)
+            start_speech()
+            speak(analysis, language)
+        save_chats()
         st.session_state.file_processed = True
         st.rerun()
 
@@ -435,4 +517,14 @@ st.markdown("""
     </p>
 """, unsafe_allow_html=True)
 
-conn.close()
+# Audio for the latest answer is attached last and polls on its own, so the
+# TTS worker never holds back the rest of the page.
+if enable_tts and st.session_state.get("tts_clips"):
+    st.session_state.tts_polling = speech_pending()
+    with speech_area:
+        st.fragment(run_every=SPEECH_POLL if st.session_state.tts_polling else None)(play_speech)()
+
+# Render timing: the first run in a process includes one-time initialization.
+run_ms = (time.perf_counter() - run_started) * 1000
+telemetry.get_recorder().record("page.cold_start" if process["runs"] == 1 else "page.rerun", run_ms)
+st.caption(f"⏱️ {'Cold start' if process['runs'] == 1 else 'Warm rerun'}: {run_ms:.0f} ms")
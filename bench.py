@@ -0,0 +1,397 @@
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import history
+import llm
+import metrics
+import storage
+import telemetry
+from gateway import LLMGateway
+from response_cache import ResponseCache
+
+# ---------------------------
+# OFFLINE BENCHMARK
+# ---------------------------
+# Drives the hot paths against a synthetic database and stub backends (LLM,
+# OpenWeatherMap, TTS engine), so it runs on a machine with no network or API
+# keys. Timings come from the same `timed` stages the app records.
+#
+#   python bench.py --rows 100000 --iterations 200 --save baseline.json
+#   python bench.py --rows 100000 --baseline baseline.json   # exits 1 on a p95 regression
+DEFAULT_ROWS = 20000
+DEFAULT_ITERATIONS = 100
+DEFAULT_TOLERANCE = 1.5
+
+
+class State(dict):
+    """Stands in for st.session_state: both key and attribute access."""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+
+class StubResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class StubRateLimit(Exception):
+    """Shaped like google.api_core's ResourceExhausted."""
+    code = 429
+
+
+class StubModel:
+    """Answers like GenerativeModel.generate_content after `latency` seconds.
+
+    With `throttle_rate`, that fraction of calls fails with a 429 instead.
+    """
+
+    def __init__(self, latency=0.05, chunks=8, throttle_rate=0.0, seed=7):
+        self.latency = latency
+        self.chunks = chunks
+        self.throttle_rate = throttle_rate
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def generate_content(self, contents, stream=False):
+        with self._lock:
+            self.calls += 1
+            throttled = self._random.random() < self.throttle_rate
+        if throttled:
+            time.sleep(self.latency / 10)
+            raise StubRateLimit("429 Resource has been exhausted (e.g. check quota).")
+        text = "Apply neem oil weekly and keep the field well drained. " * 4
+        if not stream:
+            time.sleep(self.latency)
+            return StubResponse(text)
+        words = text.split(" ")
+        step = max(1, len(words) // self.chunks)
+
+        def chunks():
+            for i in range(0, len(words), step):
+                time.sleep(self.latency / self.chunks)
+                yield StubResponse(" ".join(words[i:i + step]) + " ")
+        return chunks()
+
+
+class StubVoice:
+    def __init__(self, voice_id, languages):
+        self.id = voice_id
+        self.languages = languages
+
+
+class StubEngine:
+    """pyttsx3 stand-in that writes a short silent WAV after `latency` seconds."""
+
+    def __init__(self, latency=0.02):
+        self.latency = latency
+        self.properties = {"voices": [StubVoice("en", ["en"]), StubVoice("hi", ["hi"])]}
+        self._jobs = []
+
+    def getProperty(self, name):
+        return self.properties.get(name)
+
+    def setProperty(self, name, value):
+        self.properties[name] = value
+
+    def save_to_file(self, text, path):
+        self._jobs.append((text, path))
+
+    def runAndWait(self):
+        for text, path in self._jobs:
+            time.sleep(self.latency)
+            with wave.open(path, "wb") as f:
+                f.setnchannels(1)
+                f.setsampwidth(2)
+                f.setframerate(16000)
+                f.writeframes(b"\x00\x00" * 160 * len(text))
+        self._jobs = []
+
+
+class StubSMTP:
+    """smtplib.SMTP stand-in: each message takes `latency` seconds to "send"."""
+
+    latency = 0.005
+    messages = 0
+
+    def __init__(self, server, port, timeout=None):
+        time.sleep(StubSMTP.latency)  # connection setup
+
+    def starttls(self):
+        pass
+
+    def login(self, user, password):
+        pass
+
+    def sendmail(self, sender, recipients, message):
+        time.sleep(StubSMTP.latency)
+        StubSMTP.messages += 1
+
+    def quit(self):
+        pass
+
+
+def start_weather_stub(latency):
+    """Serve OpenWeatherMap-shaped JSON on a local port; returns (server, base_url)."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            body = json.dumps({"weather": [{"description": "scattered clouds"}],
+                               "main": {"temp": 29.5, "humidity": 71}, "dt": int(time.time())}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        request_queue_size = 128  # fetch_many opens many connections at once
+        daemon_threads = True
+
+    server = Server(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/weather"
+
+
+def seed(db_path, rows):
+    """Fill chats and alerts with `rows` messages spread over a year, then rebuild the rollup."""
+    start = time.time() - 365 * 86400
+    chats = [(f"Synthetic message {i}", "user" if i % 2 == 0 else "assistant",
+              time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(start + i * 365 * 86400 / max(rows, 1))))
+             for i in range(rows)]
+    alerts = [("weather", f"Synthetic alert {i}", chats[i * 10][2]) for i in range(rows // 10)]
+    with storage.connection(db_path) as conn:
+        with conn:
+            conn.executemany("INSERT INTO chats (message, role, timestamp) VALUES (?, ?, ?)", chats)
+            conn.executemany("INSERT INTO alerts (alert_type, message, timestamp) VALUES (?, ?, ?)", alerts)
+        metrics.backfill(conn)
+
+
+def bench_history(db_path, iterations):
+    for i in range(iterations):
+        state = State()
+        with storage.connection(db_path) as conn:
+            history.sync(state, conn)
+        storage.record_chat("user", f"Benchmark question {i}", path=db_path)
+        storage.flush(db_path)
+        with storage.connection(db_path) as conn:
+            history.sync(state, conn)
+            history.load_earlier(state, conn)
+
+
+def bench_dashboard(db_path, iterations):
+    for _ in range(iterations):
+        with storage.connection(db_path) as conn:
+            metrics.read_totals(conn)
+            with telemetry.timed("dashboard.raw"):
+                for query in metrics.RAW_TOTALS.values():
+                    conn.execute(query).fetchone()
+
+
+def unlimited_gateway():
+    # The stub has no quota; the default limits would make the benchmark measure the rate limit.
+    return LLMGateway(requests_per_minute=600000, burst=1000)
+
+
+def bench_llm(db_path, iterations, latency):
+    model = StubModel(latency)
+    cache = ResponseCache(path=db_path)
+    gateway = unlimited_gateway()
+    for i in range(iterations):
+        question = f"How do I treat leaf blight, case {i}?"
+        llm.get_ai_response(question, "English", model=model, cache=cache, gateway=gateway)
+        llm.get_ai_response(question, "English", model=model, cache=cache, gateway=gateway)
+        for _ in llm.stream_ai_response(f"Which fertilizer for rice, case {i}?", "English", model=model, cache=cache,
+                                        gateway=gateway):
+            pass
+
+
+def bench_gateway(db_path, iterations, latency):
+    """Morning peak: many sessions ask the same few questions at once, with some calls refused by quota."""
+    model = StubModel(latency, throttle_rate=0.1)
+    gateway = LLMGateway(requests_per_minute=6000, burst=50, max_concurrency=8, backoff_base=latency)
+    cache = ResponseCache(path=db_path)
+    questions = [f"Best time to sow paddy this week, variant {i % 5}?" for i in range(iterations)]
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        with telemetry.timed("gateway.peak"):
+            replies = list(pool.map(
+                lambda q: llm.get_ai_response(q, "English", model=model, cache=cache, gateway=gateway), questions))
+    stats = gateway.stats()
+    failed = sum(reply.startswith("⚠️") for reply in replies)
+    print(f"Gateway: {len(questions)} requests -> {model.calls} upstream calls, {stats['coalesced']} coalesced, "
+          f"{stats['throttled']} throttled, {stats['retries']} retried, {failed} failed")
+
+
+def bench_images(db_path, iterations, latency):
+    try:
+        from PIL import Image
+    except ImportError:
+        print("Pillow is not installed; skipping image stages.", file=sys.stderr)
+        return
+    model = StubModel(latency)
+    cache = ResponseCache(path=db_path)
+    gateway = unlimited_gateway()
+    rng = random.Random(42)
+    for i in range(iterations):
+        image = Image.frombytes("RGB", (64, 48), bytes(rng.getrandbits(8) for _ in range(64 * 48 * 3)))
+        image = image.resize((1920, 1440))
+        upload = io.BytesIO()
+        image.save(upload, format="PNG")
+        # A random photo per iteration is a miss; the same bytes again hit the duplicate index.
+        llm.analyze_crop_image(upload, f"bench-{i % 4}", model=model, cache=cache, gateway=gateway)
+        llm.analyze_crop_image(upload, f"bench-{i % 4}", model=model, cache=cache, gateway=gateway)
+
+
+def bench_weather(db_path, iterations, latency):
+    import weather
+    server, base_url = start_weather_stub(latency)
+    fresh = weather.WeatherService("bench", base_url=base_url, ttl=0, stale_ttl=0, db_path=db_path)
+    cached = weather.WeatherService("bench", base_url=base_url, db_path=db_path)
+    try:
+        for i in range(iterations):
+            fresh.get(f"City {i}")
+            cached.get("Mumbai")
+        cities = [f"District {i}" for i in range(50)]
+        with telemetry.timed("weather.fetch_many"):
+            fresh.fetch_many(cities)
+    finally:
+        fresh.close()
+        cached.close()
+        server.shutdown()
+
+
+def bench_tts(cache_dir, iterations, latency):
+    import tts
+    worker = tts.TTSWorker(cache_dir=cache_dir, engine_factory=lambda: StubEngine(latency))
+    try:
+        for i in range(iterations):
+            worker.submit(f"Sentence number {i} of the answer.", "English").result(timeout=10)
+            worker.submit(f"Sentence number {i} of the answer.", "English").result(timeout=10)
+    finally:
+        worker.close()
+
+
+def bench_alerts(db_path, count, latency):
+    """Queue `count` alerts for 20 recipients and dispatch them as digests; returns messages per second."""
+    import alerts
+    StubSMTP.latency = latency
+    StubSMTP.messages = 0
+    config = alerts.SmtpConfig("localhost", 25, "alerts@agrisense.test", "secret")
+    dispatcher = alerts.AlertDispatcher(config, db_path=db_path, smtp_factory=StubSMTP)
+    for i in range(count):
+        alerts.queue_alert("weather", f"Heavy rain expected in block {i}", recipient=f"farmer{i % 20}@example.com",
+                           db_path=db_path)
+    storage.flush(db_path, timeout=60)
+    due = time.time() + alerts.COALESCE_SECONDS + 1
+    started = time.perf_counter()
+    handled = 0
+    while True:
+        with telemetry.timed("alerts.dispatch"):
+            batch = dispatcher.dispatch_once(now=due)
+        if not batch:
+            break
+        handled += batch
+    elapsed = time.perf_counter() - started
+    print(f"Alerts: {handled} alerts sent as {StubSMTP.messages} digests in {elapsed:.2f} s")
+    return StubSMTP.messages / elapsed if elapsed else 0.0
+
+
+def bench_writer(db_path, rows):
+    started = time.perf_counter()
+    for i in range(rows):
+        storage.record_chat("user", f"Throughput message {i}", path=db_path)
+    storage.flush(db_path, timeout=60)
+    elapsed = time.perf_counter() - started
+    return rows / elapsed if elapsed else 0.0
+
+
+def compare(results, baseline, tolerance):
+    """Stages whose p95 exceeds the baseline's by more than `tolerance` times."""
+    regressions = []
+    for stage, current in results.items():
+        previous = baseline.get(stage)
+        if previous and current["p95"] > previous["p95"] * tolerance:
+            regressions.append((stage, previous["p95"], current["p95"]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark AgriSense hot paths with stubbed backends.")
+    parser.add_argument("--rows", type=int, default=DEFAULT_ROWS, help="chat rows in the synthetic database")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS, help="calls per stage")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="stub model latency in seconds")
+    parser.add_argument("--http-latency", type=float, default=0.02, help="stub weather API latency in seconds")
+    parser.add_argument("--smtp-latency", type=float, default=0.005, help="stub SMTP send latency in seconds")
+    parser.add_argument("--tts-latency", type=float, default=0.01, help="stub TTS render latency in seconds")
+    parser.add_argument("--save", help="write the results as JSON to this path")
+    parser.add_argument("--baseline", help="compare against a saved JSON result and exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed p95 slowdown factor versus the baseline")
+    args = parser.parse_args(argv)
+
+    recorder = telemetry.Recorder(persist=False)
+    telemetry.set_recorder(recorder)
+    with tempfile.TemporaryDirectory(prefix="agrisense-bench-") as workdir:
+        db_path = os.path.join(workdir, "bench.db")
+        storage.init_db(db_path)
+        started = time.perf_counter()
+        seed(db_path, args.rows)
+        print(f"Seeded {args.rows} chats in {time.perf_counter() - started:.2f} s")
+
+        bench_history(db_path, args.iterations)
+        bench_dashboard(db_path, args.iterations)
+        bench_llm(db_path, args.iterations, args.llm_latency)
+        bench_gateway(db_path, args.iterations, args.llm_latency)
+        bench_images(db_path, min(args.iterations, 20), args.llm_latency)
+        bench_weather(db_path, args.iterations, args.http_latency)
+        bench_tts(os.path.join(workdir, "tts"), args.iterations, args.tts_latency)
+        messages_per_second = bench_alerts(db_path, args.iterations * 5, args.smtp_latency)
+        writes_per_second = bench_writer(db_path, args.rows)
+        storage.shutdown()
+
+    results = {stage: {"count": count, "p50": p50, "p95": p95}
+               for stage, count, p50, p95 in telemetry.summarize(recorder.recent())}
+    print(f"\n{'stage':<24}{'calls':>8}{'p50 ms':>12}{'p95 ms':>12}")
+    for stage, row in results.items():
+        print(f"{stage:<24}{row['count']:>8}{row['p50']:>12.2f}{row['p95']:>12.2f}")
+    print(f"\nWriter throughput: {writes_per_second:,.0f} rows/s")
+    print(f"Alert dispatch: {messages_per_second:,.1f} messages/s")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"rows": args.rows, "stages": results, "writes_per_second": writes_per_second,
+                       "messages_per_second": messages_per_second}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline["stages"], args.tolerance)
+        for stage, before, after in regressions:
+            print(f"REGRESSION {stage}: p95 {before:.2f} ms -> {after:.2f} ms", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
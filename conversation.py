@@ -0,0 +1,214 @@
+import re
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import knowledge
+import storage
+from telemetry import timed
+
+# ---------------------------
+# CONVERSATION CONTEXT
+# ---------------------------
+# Each Gemini request carries a bounded slice of the browser session's own
+# chat: the latest turns verbatim plus a rolling summary of everything older,
+# and knowledge-base and market reference lines. The summary is folded forward in batches and stored
+# in conversation_summaries, so a long conversation costs the same per request
+# as a short one and the summary is never rebuilt from scratch.
+CONTEXT_TOKENS = 1500
+SUMMARY_TOKENS = 300
+REFERENCE_TOKENS = 300
+TURN_TOKENS = 250
+FOLD_TURNS = 20  # at most this many turns (~FOLD_TURNS * TURN_TOKENS) per summary request
+SCAN_TURNS = 200
+MAX_SESSIONS = 1024
+SUMMARY_TTL = 30 * 24 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversation_summaries
+    (scope TEXT PRIMARY KEY, through_id INTEGER NOT NULL, summary TEXT NOT NULL, updated_at REAL NOT NULL);
+"""
+
+Context = namedtuple("Context", ["summary", "turns", "references", "tokens"])
+
+_SENTENCE_END = re.compile(r"(?<=[.!?।])\s")
+
+
+def estimate_tokens(text):
+    """Rough token count: ~4 UTF-8 bytes per token, which also charges Indic scripts more."""
+    return (len(text.encode("utf-8")) + 3) // 4 if text else 0
+
+
+def clip(text, max_tokens):
+    """Cut `text` to about `max_tokens`, at a sentence or word boundary where possible."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    clipped = text.encode("utf-8")[:max_tokens * 4].decode("utf-8", "ignore")
+    sentences = _SENTENCE_END.split(clipped)
+    if len(sentences) > 1:
+        return " ".join(sentences[:-1]) + " …"
+    return clipped.rsplit(" ", 1)[0] + " …"
+
+
+def extractive_summary(summary, turns, max_tokens=SUMMARY_TOKENS):
+    """Offline fallback: the first sentence of each folded turn, newest kept when over budget."""
+    lines = [summary] if summary else []
+    for role, content in turns:
+        first = _SENTENCE_END.split(content.strip(), 1)[0]
+        lines.append(f"{'Farmer asked' if role == 'user' else 'AgriSense said'}: {clip(first, 60)}")
+    while len(lines) > 1 and estimate_tokens(" ".join(lines)) > max_tokens:
+        lines.pop(0)
+    return clip(" ".join(lines), max_tokens)
+
+
+def _default_summarizer(summary, turns, max_tokens):
+    import llm
+    return llm.summarize_turns(summary, turns, max_words=max_tokens * 3 // 4)
+
+
+class ContextAssembler:
+    def __init__(self, db_path=storage.DB_PATH, budget=CONTEXT_TOKENS, summary_tokens=SUMMARY_TOKENS,
+                 reference_tokens=REFERENCE_TOKENS, turn_tokens=TURN_TOKENS, fold_turns=FOLD_TURNS,
+                 summarizer=_default_summarizer, index=None):
+        self.db_path = db_path
+        self.budget = budget
+        self.summary_tokens = summary_tokens
+        self.reference_tokens = reference_tokens
+        self.turn_tokens = turn_tokens
+        self.fold_turns = fold_turns
+        self.summarizer = summarizer
+        self.index = index
+        self.folds = 0
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()  # session_id -> [through_id, summary], least recently used first
+        self._folding = set()
+        with storage.connection(db_path) as conn, conn:
+            conn.executescript(SCHEMA)
+            conn.execute("DELETE FROM conversation_summaries WHERE updated_at < ?", (time.time() - SUMMARY_TTL,))
+
+    def references(self, prompt, extra=()):
+        """Reference lines that fit the budget: `extra` (e.g. market prices) first, then KB entries."""
+        index = self.index or knowledge.get_index()
+        lines = list(extra) + [f"{m.key.title()}: {m.remedy}" for m in index.lookup(prompt)]
+        kept, used = [], 0
+        for line in lines:
+            cost = estimate_tokens(line)
+            if used + cost > self.reference_tokens:
+                continue
+            kept.append(line)
+            used += cost
+        return kept
+
+    @timed("context.assemble")
+    def assemble(self, prompt, session_id, newest_id=None, extra_references=()):
+        """Context for `prompt` from this session's chats up to `newest_id` (the last message already on screen)."""
+        references = self.references(prompt, extra_references)
+        through_id, summary = self._session(session_id)
+        turns = self._load_turns(session_id, through_id, newest_id) if session_id and newest_id else []
+        # The summary's full allowance is reserved even while it is shorter,
+        # so the total stays within budget whatever it grows to.
+        turn_budget = max(self.budget - self.summary_tokens - sum(map(estimate_tokens, references)), 0)
+        costs = [estimate_tokens(content) for _, _, content in turns]
+        first = self._fit(costs, turn_budget)
+        if first:
+            # Fold down to half the budget rather than just under it, so the
+            # summarizer runs once every few exchanges instead of every turn.
+            folded = turns[:min(self._fit(costs, turn_budget // 2), self.fold_turns)]
+            new_summary = self._fold(session_id, through_id, summary, folded)
+            if new_summary is not None:
+                summary = new_summary
+                first = max(first, len(folded))
+            # Turns neither folded nor within budget are left out until the next fold.
+            turns = turns[first:]
+        pairs = [(role, content) for _, role, content in turns]
+        tokens = estimate_tokens(summary) + sum(map(estimate_tokens, references)) + sum(
+            estimate_tokens(content) for _, content in pairs)
+        return Context(summary or None, pairs, references, tokens)
+
+    @staticmethod
+    def _fit(costs, budget):
+        """Index of the oldest turn such that it and everything newer fit `budget`."""
+        first, used = len(costs), 0
+        while first > 0 and used + costs[first - 1] <= budget:
+            first -= 1
+            used += costs[first]
+        return first
+
+    def _session(self, session_id):
+        """(through_id, summary) for a session, from memory or the database."""
+        if not session_id:
+            return 0, ""
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if state is not None:
+                self._sessions.move_to_end(session_id)
+                return tuple(state)
+        with storage.connection(self.db_path) as conn:
+            row = conn.execute("SELECT through_id, summary FROM conversation_summaries WHERE scope = ?",
+                               (session_id,)).fetchone()
+        with self._lock:
+            state = self._sessions.setdefault(session_id, list(row) if row else [0, ""])
+            while len(self._sessions) > MAX_SESSIONS:
+                self._sessions.popitem(last=False)
+            return tuple(state)
+
+    def _load_turns(self, session_id, through_id, newest_id):
+        """Unsummarized turns up to `newest_id`, oldest first, each clipped to the per-turn limit."""
+        with storage.connection(self.db_path) as conn:
+            rows = conn.execute(
+                """SELECT id, role, message FROM chats
+                   WHERE session_id = ? AND id > ? AND id <= ? ORDER BY id DESC LIMIT ?""",
+                (session_id, through_id, newest_id, SCAN_TURNS),
+            ).fetchall()
+        return [(row_id, role, clip(message, self.turn_tokens)) for row_id, role, message in reversed(rows)
+                if message and not message.startswith("⚠️ Error")]
+
+    @timed("context.fold")
+    def _fold(self, session_id, through_id, summary, turns):
+        """Fold `turns` into the session summary; returns the new summary, or None if another fold got there first.
+
+        The summarizer (a Gemini call) runs without holding the lock, so one
+        slow summary never stalls other sessions' turns.
+        """
+        if not turns:
+            return None
+        with self._lock:
+            if session_id in self._folding:
+                return None
+            self._folding.add(session_id)
+        try:
+            pairs = [(role, content) for _, role, content in turns]
+            try:
+                new_summary = self.summarizer(summary, pairs, self.summary_tokens)
+            except Exception:
+                new_summary = None
+            if not new_summary:
+                new_summary = extractive_summary(summary, pairs, self.summary_tokens)
+            new_summary = clip(new_summary, self.summary_tokens)
+            new_through_id = turns[-1][0]
+            with self._lock:
+                state = self._sessions.setdefault(session_id, [through_id, summary])
+                if state[0] != through_id:
+                    return None
+                state[:] = [new_through_id, new_summary]
+                self.folds += 1
+        finally:
+            with self._lock:
+                self._folding.discard(session_id)
+        storage.writer(self.db_path).submit(
+            "INSERT OR REPLACE INTO conversation_summaries (scope, through_id, summary, updated_at) VALUES (?, ?, ?, ?)",
+            (session_id, new_through_id, new_summary, time.time()),
+        )
+        return new_summary
+
+
+_assembler = None
+_assembler_lock = threading.Lock()
+
+
+def get_assembler():
+    global _assembler
+    with _assembler_lock:
+        if _assembler is None:
+            _assembler = ContextAssembler()
+        return _assembler
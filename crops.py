@@ -0,0 +1,98 @@
+import json
+import threading
+
+import numpy as np
+
+# ---------------------------
+# CROP RECOMMENDATION ENGINE
+# ---------------------------
+# crop_matrix.json lists, per crop, how well it suits each season and soil, its
+# water need and its N/P/K requirement. The matrix is loaded once into NumPy
+# arrays, and every plot is scored against every crop in a single broadcast, so
+# a district's plot list costs about as much as one plot.
+MATRIX_PATH = "crop_matrix.json"
+
+SEASON_WEIGHT = 0.45
+SOIL_WEIGHT = 0.35
+WATER_WEIGHT = 0.1
+NUTRIENT_WEIGHT = 0.1
+
+
+class CropEngine:
+    def __init__(self, path=MATRIX_PATH):
+        with open(path, encoding="utf-8") as f:
+            matrix = json.load(f)
+        self.seasons = [s.lower() for s in matrix["seasons"]]
+        self.soils = [s.lower() for s in matrix["soils"]]
+        self.irrigation_levels = [s.lower() for s in matrix["irrigation_levels"]]
+        crops = matrix["crops"]
+        self.crops = [c["crop"] for c in crops]
+        self.pests = [c["pests"] for c in crops]
+        self.water = [c["water"] for c in crops]
+        self.season_fit = np.array([c["season"] for c in crops], dtype=np.float32).T  # (seasons, crops)
+        self.soil_fit = np.array([c["soil"] for c in crops], dtype=np.float32).T  # (soils, crops)
+        self.water_need = np.array([self.irrigation_levels.index(c["water"].lower()) for c in crops], dtype=np.float32)
+        self.npk_need = np.array([c["npk"] for c in crops], dtype=np.float32)  # (crops, 3)
+
+    def encode(self, values, names):
+        """Map labels to indices; unknown labels become -1."""
+        lookup = {name: i for i, name in enumerate(names)}
+        return np.array([lookup.get(str(v).strip().lower(), -1) for v in values], dtype=np.intp)
+
+    def score_batch(self, season_idx, soil_idx, irrigation_idx, npk=None):
+        """Score every crop for every plot.
+
+        season_idx, soil_idx and irrigation_idx are integer arrays of shape
+        (plots,); npk is an optional (plots, 3) array of available N/P/K with NaN
+        for unknown values. Returns a (plots, crops) array; plots with an unknown
+        season or soil score -inf for every crop.
+        """
+        season_idx = np.asarray(season_idx, dtype=np.intp)
+        soil_idx = np.asarray(soil_idx, dtype=np.intp)
+        irrigation_idx = np.asarray(irrigation_idx, dtype=np.intp)
+        scores = SEASON_WEIGHT * self.season_fit[season_idx] + SOIL_WEIGHT * self.soil_fit[soil_idx]
+
+        known_irrigation = irrigation_idx >= 0
+        water_gap = np.abs(self.water_need[None, :] - irrigation_idx[:, None]) / (len(self.irrigation_levels) - 1)
+        scores -= WATER_WEIGHT * np.where(known_irrigation[:, None], water_gap, 0.0)
+
+        if npk is not None:
+            npk = np.asarray(npk, dtype=np.float32)
+            deficit = np.clip(self.npk_need[None, :, :] - npk[:, None, :], 0, None) / 100.0
+            scores -= NUTRIENT_WEIGHT * np.nan_to_num(deficit, nan=0.0).sum(axis=2)
+
+        invalid = (season_idx < 0) | (soil_idx < 0)
+        scores[invalid] = -np.inf
+        return scores
+
+    def rank_batch(self, seasons, soils, irrigation, npk=None, top=3):
+        """Return (crop indices, scores), each (plots, top), best first."""
+        scores = self.score_batch(self.encode(seasons, self.seasons), self.encode(soils, self.soils),
+                                  self.encode(irrigation, self.irrigation_levels), npk)
+        top = min(top, scores.shape[1])
+        best = np.argpartition(-scores, top - 1, axis=1)[:, :top]
+        best_scores = np.take_along_axis(scores, best, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        return np.take_along_axis(best, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+    def recommend(self, season, soil, irrigation, nitrogen=None, phosphorus=None, potassium=None, top=3):
+        npk = None
+        if any(v is not None for v in (nitrogen, phosphorus, potassium)):
+            npk = [[np.nan if v is None else v for v in (nitrogen, phosphorus, potassium)]]
+        indices, scores = self.rank_batch([season], [soil], [irrigation], npk, top)
+        return [
+            {"crop": self.crops[i], "score": float(s), "pests": self.pests[i], "irrigation": self.water[i]}
+            for i, s in zip(indices[0], scores[0]) if np.isfinite(s)
+        ]
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = CropEngine()
+        return _engine
@@ -0,0 +1,228 @@
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+from telemetry import get_recorder
+
+# ---------------------------
+# LLM GATEWAY
+# ---------------------------
+# Every Gemini call goes through one process-wide gateway. Identical requests
+# already in flight share a single upstream call (single-flight), a token
+# bucket keeps the request rate under the API quota, a semaphore bounds how
+# many calls run at once, and 429s are retried with jittered exponential
+# backoff. Queue depth and wait times are kept for the admin panel.
+REQUESTS_PER_MINUTE = 60
+BURST = 10
+MAX_CONCURRENCY = 8
+MAX_RETRIES = 4
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+QUEUE_TIMEOUT = 60.0
+
+
+class GatewayBusy(RuntimeError):
+    """No slot or rate-limit token became available within the queue timeout."""
+
+
+def is_rate_limited(error):
+    """True for quota errors: google.api_core's ResourceExhausted (HTTP 429) or anything shaped like it."""
+    return (getattr(error, "code", None) == 429 or type(error).__name__ == "ResourceExhausted"
+            or str(error).startswith("429"))
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate  # tokens per second
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, deadline):
+        """Take one token, sleeping until one is available; False if `deadline` passes first."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                delay = (1 - self._tokens) / self.rate
+            if now + delay > deadline:
+                return False
+            time.sleep(delay)
+
+    def drain(self):
+        """Empty the bucket after a 429 so every caller backs off, not just the one that was refused."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self._tokens, 0.0)
+
+    def available(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
+
+
+class LLMGateway:
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, burst=BURST, max_concurrency=MAX_CONCURRENCY,
+                 max_retries=MAX_RETRIES, backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX,
+                 queue_timeout=QUEUE_TIMEOUT):
+        self.bucket = TokenBucket(requests_per_minute / 60, burst)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.queue_timeout = queue_timeout
+        self.upstream_calls = 0
+        self.coalesced = 0
+        self.retries = 0
+        self.throttled = 0
+        self.rejected = 0
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._waiting = 0
+        self._active = 0
+        self._waits = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def call(self, fn, key=None):
+        """Run `fn()` (one upstream request) under the gateway's limits.
+
+        Callers passing the same `key` while a call is in flight wait for that
+        call and share its result or exception instead of making their own.
+        """
+        if key is None:
+            return self._call_with_retries(fn)
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+        try:
+            result = self._call_with_retries(fn)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def stream(self, open_stream):
+        """Yield from `open_stream()` while holding a slot; a 429 is retried only before the first chunk."""
+        for attempt in range(self.max_retries + 1):
+            self._acquire()
+            started = False
+            try:
+                for chunk in open_stream():
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                if started or not self._should_retry(e, attempt):
+                    raise
+            finally:
+                self._release()
+            time.sleep(self._backoff(attempt))
+
+    def _call_with_retries(self, fn):
+        for attempt in range(self.max_retries + 1):
+            self._acquire()
+            try:
+                return fn()
+            except Exception as e:
+                if not self._should_retry(e, attempt):
+                    raise
+            finally:
+                self._release()
+            time.sleep(self._backoff(attempt))
+
+    def _should_retry(self, error, attempt):
+        if not is_rate_limited(error):
+            return False
+        self.bucket.drain()
+        with self._lock:
+            self.throttled += 1
+            if attempt >= self.max_retries:
+                return False
+            self.retries += 1
+        return True
+
+    def _backoff(self, attempt):
+        # Full jitter: spreads out the callers that were refused together.
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _acquire(self):
+        started = time.monotonic()
+        deadline = started + self.queue_timeout
+        with self._lock:
+            self._waiting += 1
+        try:
+            if not self._slots.acquire(timeout=self.queue_timeout):
+                raise GatewayBusy("Too many requests are waiting for the AI service")
+            if not self.bucket.acquire(deadline):
+                self._slots.release()
+                raise GatewayBusy("AI service rate limit reached")
+        except GatewayBusy:
+            with self._lock:
+                self.rejected += 1
+            raise
+        finally:
+            waited = time.monotonic() - started
+            with self._lock:
+                self._waiting -= 1
+        with self._lock:
+            self._active += 1
+            self.upstream_calls += 1
+            self._waits += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        get_recorder().record("llm.queue_wait", waited * 1000)
+
+    def _release(self):
+        with self._lock:
+            self._active -= 1
+        self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queue_depth": self._waiting,
+                "active": self._active,
+                "in_flight_keys": len(self._in_flight),
+                "upstream_calls": self.upstream_calls,
+                "coalesced": self.coalesced,
+                "retries": self.retries,
+                "throttled": self.throttled,
+                "rejected": self.rejected,
+                "wait_ms_avg": self._wait_total / self._waits * 1000 if self._waits else 0.0,
+                "wait_ms_max": self._wait_max * 1000,
+                "tokens": self.bucket.available(),
+            }
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = LLMGateway()
+        return _gateway
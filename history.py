@@ -0,0 +1,68 @@
+import sqlite3
+
+from telemetry import timed
+
+# ---------------------------
+# CHAT HISTORY (keyset pagination)
+# ---------------------------
+# `chats.id` is an INTEGER PRIMARY KEY (the rowid), so every query below walks
+# the table's own B-tree: no sort, no scan, cost proportional to the page size.
+PAGE_SIZE = 50
+
+
+def _to_messages(rows):
+    return [{"id": row[0], "role": row[1], "content": row[2]} for row in rows]
+
+
+def load_latest(conn: sqlite3.Connection, limit=PAGE_SIZE):
+    rows = conn.execute(
+        "SELECT id, role, message FROM chats ORDER BY id DESC LIMIT ?", (limit,)
+    ).fetchall()
+    return _to_messages(reversed(rows))
+
+
+def load_before(conn: sqlite3.Connection, before_id, limit=PAGE_SIZE):
+    rows = conn.execute(
+        "SELECT id, role, message FROM chats WHERE id < ? ORDER BY id DESC LIMIT ?",
+        (before_id, limit),
+    ).fetchall()
+    return _to_messages(reversed(rows))
+
+
+def load_after(conn: sqlite3.Connection, after_id):
+    rows = conn.execute(
+        "SELECT id, role, message FROM chats WHERE id > ? ORDER BY id ASC", (after_id,)
+    ).fetchall()
+    return _to_messages(rows)
+
+
+@timed("history.sync")
+def sync(state, conn: sqlite3.Connection, page_size=PAGE_SIZE):
+    """Bring `state.messages` up to date, reading only rows past the cursor."""
+    if "history_newest_id" not in state:
+        messages = load_latest(conn, page_size)
+        state.messages = messages
+        state.history_oldest_id = messages[0]["id"] if messages else None
+        state.history_newest_id = messages[-1]["id"] if messages else 0
+        state.history_has_more = len(messages) == page_size
+        return
+
+    new_messages = load_after(conn, state.history_newest_id)
+    if new_messages:
+        state.messages.extend(new_messages)
+        state.history_newest_id = new_messages[-1]["id"]
+        if state.history_oldest_id is None:
+            state.history_oldest_id = new_messages[0]["id"]
+
+
+@timed("history.load_earlier")
+def load_earlier(state, conn: sqlite3.Connection, page_size=PAGE_SIZE):
+    """Prepend the page of messages just before the oldest one on screen."""
+    if state.history_oldest_id is None:
+        state.history_has_more = False
+        return
+    older = load_before(conn, state.history_oldest_id, page_size)
+    if older:
+        state.messages[:0] = older
+        state.history_oldest_id = older[0]["id"]
+    state.history_has_more = len(older) == page_size
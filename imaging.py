@@ -0,0 +1,124 @@
+import hashlib
+import io
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from PIL import Image, ImageOps
+
+from telemetry import timed
+
+# ---------------------------
+# CROP IMAGE PREPROCESSING
+# ---------------------------
+# Every upload is decoded once, turned upright from its EXIF orientation,
+# downscaled and re-encoded as JPEG under a byte budget before it goes to
+# Gemini. A 64-bit difference hash lets near-identical field photos share one
+# diagnosis.
+MAX_SIDE = 1280
+TARGET_BYTES = 300 * 1024
+MIN_QUALITY = 50
+DUPLICATE_DISTANCE = 6
+
+PreparedImage = namedtuple("PreparedImage", ["image", "payload", "phash", "digest"])
+
+
+def _read_bytes(source):
+    if isinstance(source, (bytes, bytearray)):
+        return bytes(source)
+    if hasattr(source, "getvalue"):
+        return source.getvalue()
+    with open(source, "rb") as f:
+        return f.read()
+
+
+def dhash(image, size=8):
+    """Difference hash: one bit per horizontally adjacent pixel pair of a 9x8 greyscale thumbnail."""
+    pixels = list(image.convert("L").resize((size + 1, size), Image.BILINEAR).getdata())
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return bits
+
+
+def encode_jpeg(image, target_bytes=TARGET_BYTES):
+    quality = 85
+    while True:
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=quality, optimize=True)
+        if buffer.tell() <= target_bytes or quality <= MIN_QUALITY:
+            return buffer.getvalue()
+        quality -= 10
+
+
+@timed("image.prepare")
+def prepare_image(source, max_side=MAX_SIDE, target_bytes=TARGET_BYTES):
+    data = _read_bytes(source)
+    image = Image.open(io.BytesIO(data))
+    image = ImageOps.exif_transpose(image)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+    payload = encode_jpeg(image, target_bytes)
+    return PreparedImage(image, payload, dhash(image), hashlib.sha256(data).hexdigest())
+
+
+class NearDuplicateIndex:
+    """Maps perceptual hashes to values, matching within `max_distance` bits.
+
+    The 64-bit hash is split into 8 one-byte bands; two hashes within 7 bits of
+    each other must agree on at least one band, so only those buckets are scanned.
+    With `max_entries` or `ttl`, the oldest entries are dropped first.
+    """
+
+    BANDS = 8
+
+    def __init__(self, max_distance=DUPLICATE_DISTANCE, max_entries=None, ttl=None):
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._values = OrderedDict()  # phash -> (value, added_at), oldest first
+        self._buckets = [dict() for _ in range(self.BANDS)]
+        self._lock = threading.Lock()
+
+    def _bands(self, phash):
+        return [(phash >> (8 * i)) & 0xFF for i in range(self.BANDS)]
+
+    def _evict(self, now):
+        while self._values:
+            phash, (_, added_at) = next(iter(self._values.items()))
+            expired = self.ttl is not None and now - added_at > self.ttl
+            if not expired and (self.max_entries is None or len(self._values) <= self.max_entries):
+                return
+            del self._values[phash]
+            for band, bucket in zip(self._bands(phash), self._buckets):
+                bucket[band].remove(phash)
+                if not bucket[band]:
+                    del bucket[band]
+
+    def find(self, phash):
+        with self._lock:
+            self._evict(time.monotonic())
+            best = None
+            for band, bucket in zip(self._bands(phash), self._buckets):
+                for candidate in bucket.get(band, ()):
+                    distance = bin(candidate ^ phash).count("1")
+                    if distance <= self.max_distance and (best is None or distance < best[0]):
+                        best = (distance, candidate)
+            return None if best is None else self._values[best[1]][0]
+
+    def add(self, phash, value):
+        with self._lock:
+            if phash in self._values:
+                self._values.move_to_end(phash)
+            else:
+                for band, bucket in zip(self._bands(phash), self._buckets):
+                    bucket.setdefault(band, []).append(phash)
+            self._values[phash] = (value, time.monotonic())
+            self._evict(time.monotonic())
+
+    def __len__(self):
+        return len(self._values)
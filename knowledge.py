@@ -0,0 +1,237 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict, namedtuple
+
+import numpy as np
+
+# ---------------------------
+# LOCAL KNOWLEDGE BASE
+# ---------------------------
+# knowledge_base.json maps a problem ("banana leaf spot") to its remedy. The
+# entries are held in a trigram index so misspelt questions still match, and a
+# confident match is answered locally without calling Gemini: the entry must
+# both appear in the question and make up most of its content words, so a
+# longer question that merely mentions "rice" and "blast" still goes to
+# Gemini. Postings are
+# kept as NumPy arrays so a lookup counts shared trigrams for every entry in
+# one bincount instead of walking common grams ("lea", "eaf") in Python.
+KB_PATH = "knowledge_base.json"
+DIRECT_ANSWER_SCORE = 0.75
+DIRECT_ANSWER_COVERAGE = 0.6
+MIN_SCORE = 0.5
+
+# score: share of the entry's trigrams found in the question (relevance as a
+# reference line); coverage: share of the question's content trigrams the entry explains.
+Match = namedtuple("Match", ["key", "remedy", "score", "coverage"])
+
+_CONFLICT_MARKER = re.compile(r"^(<{7}|={7}|>{7})( .*)?$", re.MULTILINE)
+_WORD = re.compile(r"\w+")
+# Words that frame a question without saying what it is about; left out when
+# measuring how much of the question an entry covers.
+QUESTION_WORDS = frozenset(
+    "a an the is are my i me how what which why when to do does for of in on with can should please "
+    "treat treatment cure control remedy solution problem".split())
+
+
+class KnowledgeBaseError(ValueError):
+    pass
+
+
+def _resolve_conflict(text):
+    """Accept a merge-conflicted file only if every side parses to the same data."""
+    sides = [[], []]
+    current = None
+    for line in text.splitlines():
+        if line.startswith("<<<<<<<"):
+            current = 0
+        elif line.startswith("=======") and current == 0:
+            current = 1
+        elif line.startswith(">>>>>>>"):
+            current = None
+        elif current is None:
+            sides[0].append(line)
+            sides[1].append(line)
+        else:
+            sides[current].append(line)
+    try:
+        ours, theirs = (json.loads("\n".join(side)) for side in sides)
+    except json.JSONDecodeError as e:
+        raise KnowledgeBaseError(f"Unresolved merge conflict in knowledge base: {e}") from None
+    if ours != theirs:
+        raise KnowledgeBaseError("Unresolved merge conflict in knowledge base: the two sides differ")
+    return ours
+
+
+def parse_entries(text):
+    if _CONFLICT_MARKER.search(text):
+        data = _resolve_conflict(text)
+    else:
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise KnowledgeBaseError(f"Knowledge base is not valid JSON: {e}") from None
+    if not isinstance(data, dict):
+        raise KnowledgeBaseError("Knowledge base must be a JSON object of problem -> remedy")
+    entries = {}
+    for key, remedy in data.items():
+        if not isinstance(remedy, str) or not remedy.strip():
+            raise KnowledgeBaseError(f"Knowledge base entry {key!r} has no remedy text")
+        normalized = normalize(key)
+        if normalized:
+            entries[normalized] = remedy.strip()
+    return entries
+
+
+def normalize(text):
+    return " ".join(_WORD.findall(text.lower()))
+
+
+def trigrams(text):
+    grams = set()
+    for word in _WORD.findall(text.lower()):
+        padded = f" {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class KnowledgeIndex:
+    def __init__(self, path=KB_PATH, check_interval=2.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.RLock()
+        self._entries = {}
+        self._doc_ids = {}
+        self._doc_keys = {}
+        self._doc_sizes = {}
+        self._postings = defaultdict(set)
+        self._posting_arrays = {}  # gram -> sorted doc ids, rebuilt lazily after the gram changes
+        self._size_array = None  # doc id -> trigram count (inf for removed ids), rebuilt lazily
+        self._next_id = 0
+        self._signature = None
+        self._last_check = 0.0
+        self.error = None  # why the file on disk was last rejected, while the previous entries stay in use
+        self.maybe_reload(force=True)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def maybe_reload(self, force=False):
+        """Re-read the file if it changed, re-indexing only entries that differ."""
+        now = time.monotonic()
+        if not force and now - self._last_check < self.check_interval:
+            return False
+        self._last_check = now
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if signature == self._signature:
+            return False
+        # Recorded before parsing so a broken file is reported once, not re-read every check.
+        self._signature = signature
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                entries = parse_entries(f.read())
+        except (KnowledgeBaseError, OSError, UnicodeDecodeError) as e:
+            self.error = str(e)
+            return False
+        self.update(entries)
+        self.error = None
+        return True
+
+    def update(self, entries):
+        with self._lock:
+            for key in self._entries.keys() - entries.keys():
+                self._remove(key)
+            for key, remedy in entries.items():
+                if key not in self._entries:
+                    self._add(key)
+                self._entries[key] = remedy
+
+    def lookup(self, question, limit=3):
+        query = trigrams(question)
+        if not query:
+            return []
+        with self._lock:
+            arrays = [self._posting_array(gram) for gram in query if gram in self._postings]
+            if not arrays:
+                return []
+            shared = np.bincount(np.concatenate(arrays), minlength=self._next_id)
+            # How much of the entry's name appears in the question, so that
+            # "how to treat banana leef spot?" still scores high for "banana leaf spot".
+            scores = shared / self._sizes()
+            candidates = np.flatnonzero(scores >= MIN_SCORE)
+            if len(candidates) > limit:
+                candidates = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+            found = [(self._doc_keys[i], self._entries[self._doc_keys[i]], float(scores[i]))
+                     for i in candidates.tolist()]
+        content = trigrams(" ".join(w for w in _WORD.findall(question.lower()) if w not in QUESTION_WORDS)) or query
+        scored = [Match(key, remedy, score, len(trigrams(key) & content) / len(content))
+                  for key, remedy, score in found]
+        scored.sort(key=lambda m: m.score, reverse=True)
+        return scored
+
+    def best_answer(self, question, min_score=DIRECT_ANSWER_SCORE, min_coverage=DIRECT_ANSWER_COVERAGE):
+        self.maybe_reload()
+        for match in self.lookup(question):
+            if match.score >= min_score and match.coverage >= min_coverage:
+                return match
+        return None
+
+    def _posting_array(self, gram):
+        array = self._posting_arrays.get(gram)
+        if array is None:
+            array = self._posting_arrays[gram] = np.fromiter(sorted(self._postings[gram]), dtype=np.intp)
+        return array
+
+    def _sizes(self):
+        if self._size_array is None:
+            sizes = np.full(self._next_id, np.inf)
+            sizes[list(self._doc_sizes)] = list(self._doc_sizes.values())
+            self._size_array = sizes
+        return self._size_array
+
+    def _add(self, key):
+        doc_id = self._next_id
+        self._next_id += 1
+        grams = trigrams(key)
+        self._doc_ids[key] = doc_id
+        self._doc_keys[doc_id] = key
+        self._doc_sizes[doc_id] = len(grams)
+        self._size_array = None
+        for gram in grams:
+            self._postings[gram].add(doc_id)
+            self._posting_arrays.pop(gram, None)
+
+    def _remove(self, key):
+        doc_id = self._doc_ids.pop(key)
+        for gram in trigrams(key):
+            postings = self._postings[gram]
+            postings.discard(doc_id)
+            self._posting_arrays.pop(gram, None)
+            if not postings:
+                del self._postings[gram]
+        del self._doc_keys[doc_id]
+        del self._doc_sizes[doc_id]
+        self._size_array = None
+        del self._entries[key]
+
+
+def format_answer(match):
+    return f"🌿 {match.key.title()}: {match.remedy}"
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = KnowledgeIndex()
+        return _index
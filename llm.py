@@ -0,0 +1,237 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from gateway import GatewayBusy, get_gateway, is_rate_limited
+from response_cache import ResponseCache, make_key
+from telemetry import get_recorder, timed
+
+# ---------------------------
+# GEMINI CLIENT
+# ---------------------------
+MODEL_NAME = "gemini-1.5-flash"
+
+CHAT_PROMPT = (
+    "You are AgriSense, an advanced AI farming assistant. Provide detailed, expert advice on crops, weather impacts, "
+    "soil health, pest control, market trends, and general agriculture queries. Include practical remedies and local "
+    "context (e.g., India, {now}). Respond in {language} with a friendly, authoritative tone.\n"
+    "{context}User: {prompt}"
+)
+SUMMARY_PROMPT = (
+    "Update the running summary of a conversation between a farmer and AgriSense. Keep crops, locations, "
+    "symptoms, quantities, advice already given and open questions; drop greetings and repetition. Reply with "
+    "the updated summary only, in at most {words} words.\n"
+    "Current summary: {summary}\n"
+    "New turns:\n{turns}"
+)
+IMAGE_PROMPT = (
+    "Analyze this crop image for diseases, pests, or issues. Provide detailed diagnosis, remedies, and prevention "
+    "tips as AgriSense. Respond in {language}."
+)
+
+BUSY_MESSAGE = "⚠️ AgriSense is answering a lot of questions right now. Please try again in a minute."
+
+IST = timezone(timedelta(hours=5, minutes=30), "IST")
+ROLE_LABELS = {"user": "User", "assistant": "AgriSense"}
+
+_lock = threading.Lock()
+_api_key = None
+_model = None
+_cache = None
+_duplicates = {}
+DUPLICATE_ENTRIES = 4096
+
+
+def configure(api_key):
+    """Set the Gemini API key; the SDK itself is only imported when a model is first needed."""
+    global _api_key, _model
+    with _lock:
+        if api_key != _api_key:
+            _api_key = api_key
+            _model = None
+
+
+def get_model():
+    """The shared GenerativeModel, built on first use and reused afterwards."""
+    global _model
+    with _lock:
+        if _model is None:
+            import google.generativeai as genai
+            genai.configure(api_key=_api_key)
+            _model = genai.GenerativeModel(MODEL_NAME)
+        return _model
+
+
+def get_cache():
+    global _cache
+    with _lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
+
+
+def _error_message(error, prefix="⚠️ Error: "):
+    if isinstance(error, GatewayBusy) or is_rate_limited(error):
+        return BUSY_MESSAGE
+    return f"{prefix}{str(error)}"
+
+
+def local_time(now=None):
+    now = now or datetime.now(IST)
+    return now.astimezone(IST).strftime("%I:%M %p IST, %b %d, %Y")
+
+
+def format_turns(turns):
+    return "".join(f"{ROLE_LABELS.get(role, role)}: {content}\n" for role, content in turns)
+
+
+def build_prompt(prompt, language, context=None, summary=None, turns=(), now=None):
+    """The chat prompt: conversation summary and recent turns, then reference lines
+    (e.g. local market prices, knowledge-base entries), then the question."""
+    blocks = []
+    if summary:
+        blocks.append(f"Earlier in this conversation: {summary}\n")
+    if turns:
+        blocks.append("Recent conversation:\n" + format_turns(turns))
+    blocks.extend(f"Reference: {line}\n" for line in context or [])
+    return CHAT_PROMPT.format(language=language, prompt=prompt, context="".join(blocks), now=local_time(now))
+
+
+def _chat_key(prompt, language, context=None, summary=None, turns=()):
+    # Reference lines are always part of the key: a price question must miss
+    # once a new price CSV changes them. A standalone question adds nothing
+    # else, so the same question from different farmers hits the cache (and
+    # shares one in-flight call). Once conversation is sent, the answer
+    # depends on it: "and for wheat?" means something different after each history.
+    parts = [prompt, *(context or [])]
+    if summary or turns:
+        parts += [summary or "", *(f"{role}: {content}" for role, content in turns)]
+    return make_key("\n".join(parts), language, MODEL_NAME)
+
+
+@timed("llm.response")
+def get_ai_response(prompt, language, model=None, cache=None, context=None, summary=None, turns=(), gateway=None):
+    model = model or get_model()
+    cache = cache or get_cache()
+    key = _chat_key(prompt, language, context, summary, turns)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    def generate():
+        with timed("llm.generate"):
+            reply = model.generate_content(build_prompt(prompt, language, context, summary, turns)).text
+        cache.put(key, reply)
+        return reply
+
+    try:
+        # Identical questions asked at the same moment share one call.
+        return (gateway or get_gateway()).call(generate, key=key)
+    except Exception as e:
+        return _error_message(e)
+
+
+def stream_ai_response(prompt, language, model=None, cache=None, context=None, summary=None, turns=(), gateway=None):
+    """Yield the answer as it is generated; the full text is cached at the end."""
+    model = model or get_model()
+    cache = cache or get_cache()
+    key = _chat_key(prompt, language, context, summary, turns)
+    cached = cache.get(key)
+    if cached is not None:
+        yield cached
+        return
+    parts = []
+    started = time.perf_counter()
+    try:
+        full_prompt = build_prompt(prompt, language, context, summary, turns)
+        for chunk in (gateway or get_gateway()).stream(lambda: model.generate_content(full_prompt, stream=True)):
+            text = chunk.text
+            if text:
+                if not parts:
+                    get_recorder().record("llm.first_token", (time.perf_counter() - started) * 1000)
+                parts.append(text)
+                yield text
+    except Exception as e:
+        prefix = "\n\n" if parts else ""
+        yield prefix + _error_message(e)
+        return
+    get_recorder().record("llm.stream", (time.perf_counter() - started) * 1000)
+    cache.put(key, "".join(parts))
+
+
+@timed("llm.summarize")
+def summarize_turns(summary, turns, max_words, model=None, gateway=None):
+    """Fold `turns` into the running `summary`; raises on API errors so callers can fall back."""
+    model = model or get_model()
+    request = SUMMARY_PROMPT.format(words=max_words, summary=summary or "(none)", turns=format_turns(turns))
+    return (gateway or get_gateway()).call(lambda: model.generate_content(request).text.strip())
+
+
+def get_duplicate_index(language, ttl=None):
+    """Per-language index from photo hashes to the cache key of a near-identical photo's answer."""
+    from imaging import NearDuplicateIndex
+    with _lock:
+        if language not in _duplicates:
+            _duplicates[language] = NearDuplicateIndex(max_entries=DUPLICATE_ENTRIES, ttl=ttl)
+        return _duplicates[language]
+
+
+@timed("image.analyze")
+def analyze_crop_image(image_source, language, model=None, cache=None, gateway=None):
+    """Diagnose an upload (or a PreparedImage), reusing answers for near-identical photos."""
+    from imaging import PreparedImage, prepare_image
+    model = model or get_model()
+    cache = cache or get_cache()
+    try:
+        prepared = image_source if isinstance(image_source, PreparedImage) else prepare_image(image_source)
+        # The index only maps near-duplicates to a shared key; the answer itself
+        # always comes from the response cache, so its TTL applies.
+        duplicates = get_duplicate_index(language, cache.ttl)
+        key = duplicates.find(prepared.phash) or make_key(f"image:{prepared.phash:016x}", language, MODEL_NAME)
+        analysis = cache.get(key)
+        if analysis is None:
+            image_part = {"mime_type": "image/jpeg", "data": prepared.payload}
+
+            def generate():
+                text = model.generate_content([IMAGE_PROMPT.format(language=language), image_part]).text
+                cache.put(key, text)
+                return text
+
+            analysis = (gateway or get_gateway()).call(generate, key=key)
+    except Exception as e:
+        return _error_message(e, "Error analyzing image: ")
+    duplicates.add(prepared.phash, key)
+    return analysis
+
+
+def analyze_crop_images(image_sources, language, max_workers=4, model=None, cache=None, gateway=None):
+    """Analyze a batch of uploads concurrently, one API call per group of near-duplicates."""
+    from imaging import NearDuplicateIndex, PreparedImage, prepare_image
+
+    def prepare(source):
+        try:
+            return source if isinstance(source, PreparedImage) else prepare_image(source)
+        except Exception as e:
+            return f"Error analyzing image: {str(e)}"
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        prepared = list(pool.map(prepare, image_sources))
+        # Group near-identical photos first so concurrent workers don't all miss
+        # the duplicate index for the same scene.
+        groups = NearDuplicateIndex()
+        representatives = []
+        members = []
+        for image in prepared:
+            if isinstance(image, str):
+                members.append(image)
+                continue
+            group = groups.find(image.phash)
+            if group is None:
+                group = len(representatives)
+                groups.add(image.phash, group)
+                representatives.append(image)
+            members.append(group)
+        results = list(pool.map(lambda image: analyze_crop_image(image, language, model, cache, gateway),
+                                representatives))
+    return [group if isinstance(group, str) else results[group] for group in members]
@@ -0,0 +1,215 @@
+import csv
+import io
+import itertools
+import os
+import re
+import threading
+from datetime import datetime
+
+import storage
+
+# ---------------------------
+# MARKET PRICE STORE
+# ---------------------------
+# Mandi price history lives in a WITHOUT ROWID table clustered on
+# (crop, market, day), plus a covering (crop, day) index for cross-market
+# queries, so latest-price, date-range and rolling lookups touch only the rows
+# they return. Prices are stored as given by the source, in ₹ per quintal.
+CHUNK_ROWS = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS market_prices
+    (crop TEXT NOT NULL, market TEXT NOT NULL, day TEXT NOT NULL, price REAL NOT NULL,
+     PRIMARY KEY (crop, market, day)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_market_prices_crop_day ON market_prices (crop, day, price);
+"""
+
+COLUMN_ALIASES = {
+    "crop": ("crop", "commodity", "commodity name"),
+    "market": ("market", "mandi", "market name", "apmc"),
+    "day": ("date", "day", "arrival_date", "arrival date", "price date"),
+    "price": ("price", "modal_price", "modal price", "modal price (rs./quintal)", "modal_price_rs_quintal"),
+}
+DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d-%b-%Y", "%d %b %Y")
+
+
+def _normalize_name(name):
+    return re.sub(r"\s+", " ", name.strip()).title()
+
+
+def parse_day(value):
+    value = value.strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def _resolve_columns(header):
+    normalized = [h.strip().lower() for h in header]
+    columns = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in normalized:
+                columns[field] = normalized.index(alias)
+                break
+        else:
+            raise ValueError(f"Price CSV is missing a {field} column")
+    return columns
+
+
+def _parse_row(row, columns):
+    try:
+        crop, market = row[columns["crop"]], row[columns["market"]]
+        day = parse_day(row[columns["day"]])
+        price = float(row[columns["price"]].replace(",", ""))
+    except (IndexError, ValueError):
+        return None
+    if not crop.strip() or not market.strip() or day is None:
+        return None
+    return _normalize_name(crop), _normalize_name(market), day, price
+
+
+class MarketStore:
+    def __init__(self, db_path=storage.DB_PATH):
+        self.db_path = db_path
+        self._crops = None
+        with storage.connection(db_path) as conn:
+            conn.executescript(SCHEMA)
+
+    def ingest_csv(self, source, chunk_rows=CHUNK_ROWS):
+        """Load a price CSV (path, text stream or upload) in chunks; returns (loaded, skipped)."""
+        if isinstance(source, (str, os.PathLike)):
+            stream = open(source, encoding="utf-8-sig", newline="")
+            release = stream.close
+        elif isinstance(source, io.TextIOBase):
+            stream, release = source, None
+        else:
+            stream = io.TextIOWrapper(source, encoding="utf-8-sig", newline="")
+            release = stream.detach
+        loaded = skipped = 0
+        try:
+            reader = csv.reader(stream)
+            header = next(reader, None)
+            if header is None:
+                raise ValueError("Price CSV is empty")
+            columns = _resolve_columns(header)
+            while True:
+                rows = list(itertools.islice(reader, chunk_rows))
+                if not rows:
+                    break
+                parsed = [r for r in (_parse_row(row, columns) for row in rows) if r is not None]
+                skipped += len(rows) - len(parsed)
+                with storage.connection(self.db_path) as conn, conn:
+                    conn.executemany("INSERT OR REPLACE INTO market_prices VALUES (?, ?, ?, ?)", parsed)
+                loaded += len(parsed)
+        finally:
+            if release is not None:
+                release()
+        self._crops = None
+        return loaded, skipped
+
+    def ingest_files(self, paths):
+        totals = [0, 0]
+        for path in paths:
+            loaded, skipped = self.ingest_csv(path)
+            totals[0] += loaded
+            totals[1] += skipped
+        return tuple(totals)
+
+    def crops(self):
+        if self._crops is None:
+            with storage.connection(self.db_path) as conn:
+                # Skip-scan over the primary key: one probe per distinct crop.
+                crops, crop = [], conn.execute("SELECT MIN(crop) FROM market_prices").fetchone()[0]
+                while crop is not None:
+                    crops.append(crop)
+                    crop = conn.execute("SELECT MIN(crop) FROM market_prices WHERE crop > ?", (crop,)).fetchone()[0]
+            self._crops = crops
+        return self._crops
+
+    def latest_price(self, crop, market=None):
+        """Latest (day, price, markets) for a crop; price is averaged across markets unless one is given."""
+        crop = _normalize_name(crop)
+        with storage.connection(self.db_path) as conn:
+            if market:
+                row = conn.execute(
+                    "SELECT day, price, 1 FROM market_prices WHERE crop = ? AND market = ? ORDER BY day DESC LIMIT 1",
+                    (crop, _normalize_name(market)),
+                ).fetchone()
+            else:
+                row = conn.execute(
+                    """SELECT day, AVG(price), COUNT(*) FROM market_prices
+                       WHERE crop = ? AND day = (SELECT MAX(day) FROM market_prices WHERE crop = ?)""",
+                    (crop, crop),
+                ).fetchone()
+        return None if row is None or row[0] is None else row
+
+    def price_range(self, crop, start, end, market=None):
+        """(day, market, price) rows for a crop between two ISO dates, inclusive."""
+        crop = _normalize_name(crop)
+        with storage.connection(self.db_path) as conn:
+            if market:
+                return conn.execute(
+                    """SELECT day, market, price FROM market_prices
+                       WHERE crop = ? AND market = ? AND day BETWEEN ? AND ? ORDER BY day""",
+                    (crop, _normalize_name(market), start, end),
+                ).fetchall()
+            return conn.execute(
+                """SELECT day, market, price FROM market_prices INDEXED BY idx_market_prices_crop_day
+                   WHERE crop = ? AND day BETWEEN ? AND ? ORDER BY day""",
+                (crop, start, end),
+            ).fetchall()
+
+    def rolling_stats(self, crop, start, end, window=7, market=None):
+        """Daily price with rolling mean and standard deviation over `window` trading days."""
+        crop = _normalize_name(crop)
+        market_filter = "AND market = ?" if market else ""
+        params = [crop, start, end] + ([_normalize_name(market)] if market else [])
+        frame = f"ROWS BETWEEN {int(window) - 1} PRECEDING AND CURRENT ROW"
+        with storage.connection(self.db_path) as conn:
+            rows = conn.execute(
+                f"""WITH daily AS (
+                        SELECT day, AVG(price) AS price FROM market_prices
+                        WHERE crop = ? AND day BETWEEN ? AND ? {market_filter} GROUP BY day)
+                    SELECT day, price,
+                           AVG(price) OVER w,
+                           AVG(price * price) OVER w - AVG(price) OVER w * AVG(price) OVER w
+                    FROM daily WINDOW w AS (ORDER BY day {frame}) ORDER BY day""",
+                params,
+            ).fetchall()
+        return [(day, price, mean, max(variance, 0.0) ** 0.5) for day, price, mean, variance in rows]
+
+    def summary(self, crop, days=30):
+        """One-line price summary for the sidebar and LLM prompt context, or None."""
+        latest = self.latest_price(crop)
+        if latest is None:
+            return None
+        day, price, markets = latest
+        start = datetime.fromisoformat(day).date().toordinal() - days + 1
+        stats = self.rolling_stats(crop, datetime.fromordinal(start).date().isoformat(), day, window=days)
+        mean, std = stats[-1][2], stats[-1][3]
+        volatility = std / mean * 100 if mean else 0.0
+        where = f"average of {markets} markets" if markets > 1 else "1 market"
+        return (f"{_normalize_name(crop)}: ₹{price:,.0f}/quintal (₹{price / 100:,.2f}/kg) on {day}, {where}; "
+                f"{days}-day average ₹{mean:,.0f}/quintal, volatility {volatility:.1f}%")
+
+    def context_for(self, text, limit=3):
+        """Price summaries for crops named in `text`, for the LLM prompt."""
+        lowered = text.lower()
+        mentioned = [crop for crop in self.crops() if re.search(rf"\b{re.escape(crop.lower())}\b", lowered)]
+        return [s for s in (self.summary(crop) for crop in mentioned[:limit]) if s]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = MarketStore()
+        return _store
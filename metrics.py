@@ -0,0 +1,140 @@
+import sqlite3
+
+from telemetry import timed
+
+# ---------------------------
+# DASHBOARD ROLLUP
+# ---------------------------
+# Per-day counters plus a handful of running totals, kept current by triggers on
+# `chats` and `alerts` (inserts, deletes, and updates of role or timestamp),
+# so the dashboard reads three rows instead of scanning both tables on every
+# rerun. repair() compares the rollup with the raw aggregates and rebuilds it
+# if they have drifted apart.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS daily_metrics
+    (day TEXT PRIMARY KEY, chats INTEGER NOT NULL DEFAULT 0, answers INTEGER NOT NULL DEFAULT 0,
+     alerts INTEGER NOT NULL DEFAULT 0);
+CREATE TABLE IF NOT EXISTS metric_totals
+    (name TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0);
+
+CREATE TRIGGER IF NOT EXISTS chats_metrics_insert AFTER INSERT ON chats
+WHEN DATE(NEW.timestamp) IS NOT NULL
+BEGIN
+    UPDATE metric_totals SET value = value + 1
+     WHERE name = 'active_days'
+       AND NOT EXISTS (SELECT 1 FROM daily_metrics WHERE day = DATE(NEW.timestamp) AND chats > 0);
+    INSERT INTO daily_metrics (day, chats, answers) VALUES (DATE(NEW.timestamp), 1, NEW.role = 'assistant')
+        ON CONFLICT(day) DO UPDATE SET chats = chats + 1, answers = answers + excluded.answers;
+END;
+
+CREATE TRIGGER IF NOT EXISTS chats_metrics_answer AFTER INSERT ON chats
+WHEN NEW.role = 'assistant'
+BEGIN
+    UPDATE metric_totals SET value = value + 1 WHERE name = 'queries_solved';
+END;
+
+CREATE TRIGGER IF NOT EXISTS chats_metrics_delete AFTER DELETE ON chats
+BEGIN
+    UPDATE metric_totals SET value = value - 1 WHERE name = 'queries_solved' AND OLD.role = 'assistant';
+    UPDATE daily_metrics SET chats = chats - 1, answers = answers - (OLD.role = 'assistant')
+     WHERE day = DATE(OLD.timestamp);
+    UPDATE metric_totals SET value = value - 1
+     WHERE name = 'active_days'
+       AND EXISTS (SELECT 1 FROM daily_metrics WHERE day = DATE(OLD.timestamp) AND chats = 0);
+END;
+
+-- An update moves the row out of its old day/role and into the new one.
+CREATE TRIGGER IF NOT EXISTS chats_metrics_update AFTER UPDATE OF role, timestamp ON chats
+BEGIN
+    UPDATE metric_totals SET value = value - 1 WHERE name = 'queries_solved' AND OLD.role = 'assistant';
+    UPDATE daily_metrics SET chats = chats - 1, answers = answers - (OLD.role = 'assistant')
+     WHERE day = DATE(OLD.timestamp);
+    UPDATE metric_totals SET value = value - 1
+     WHERE name = 'active_days'
+       AND EXISTS (SELECT 1 FROM daily_metrics WHERE day = DATE(OLD.timestamp) AND chats = 0);
+    UPDATE metric_totals SET value = value + 1 WHERE name = 'queries_solved' AND NEW.role = 'assistant';
+    UPDATE metric_totals SET value = value + 1
+     WHERE name = 'active_days' AND DATE(NEW.timestamp) IS NOT NULL
+       AND NOT EXISTS (SELECT 1 FROM daily_metrics WHERE day = DATE(NEW.timestamp) AND chats > 0);
+    INSERT INTO daily_metrics (day, chats, answers)
+        SELECT DATE(NEW.timestamp), 1, NEW.role = 'assistant' WHERE DATE(NEW.timestamp) IS NOT NULL
+        ON CONFLICT(day) DO UPDATE SET chats = chats + 1, answers = answers + excluded.answers;
+END;
+
+CREATE TRIGGER IF NOT EXISTS alerts_metrics_insert AFTER INSERT ON alerts
+BEGIN
+    UPDATE metric_totals SET value = value + 1 WHERE name = 'weather_alerts';
+    INSERT INTO daily_metrics (day, alerts) SELECT DATE(NEW.timestamp), 1 WHERE DATE(NEW.timestamp) IS NOT NULL
+        ON CONFLICT(day) DO UPDATE SET alerts = alerts + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS alerts_metrics_delete AFTER DELETE ON alerts
+BEGIN
+    UPDATE metric_totals SET value = value - 1 WHERE name = 'weather_alerts';
+    UPDATE daily_metrics SET alerts = alerts - 1 WHERE day = DATE(OLD.timestamp);
+END;
+
+CREATE TRIGGER IF NOT EXISTS alerts_metrics_update AFTER UPDATE OF timestamp ON alerts
+BEGIN
+    UPDATE daily_metrics SET alerts = alerts - 1 WHERE day = DATE(OLD.timestamp);
+    INSERT INTO daily_metrics (day, alerts) SELECT DATE(NEW.timestamp), 1 WHERE DATE(NEW.timestamp) IS NOT NULL
+        ON CONFLICT(day) DO UPDATE SET alerts = alerts + 1;
+END;
+"""
+
+# The raw aggregates the rollup stands in for; only used by backfill/verify.
+RAW_TOTALS = {
+    "queries_solved": "SELECT COUNT(*) FROM chats WHERE role = 'assistant'",
+    "weather_alerts": "SELECT COUNT(*) FROM alerts",
+    "active_days": "SELECT COUNT(DISTINCT DATE(timestamp)) FROM chats",
+}
+
+
+def install(conn: sqlite3.Connection):
+    """Create the rollup tables and triggers, backfilling them the first time."""
+    conn.executescript(SCHEMA)
+    if conn.execute("SELECT COUNT(*) FROM metric_totals").fetchone()[0] < len(RAW_TOTALS):
+        backfill(conn)
+
+
+def backfill(conn: sqlite3.Connection):
+    """Rebuild the rollup from the raw tables in a single transaction."""
+    with conn:
+        conn.execute("DELETE FROM daily_metrics")
+        conn.execute("DELETE FROM metric_totals")
+        conn.execute("""INSERT INTO daily_metrics (day, chats, answers)
+                        SELECT DATE(timestamp), COUNT(*), SUM(role = 'assistant') FROM chats
+                        WHERE DATE(timestamp) IS NOT NULL GROUP BY DATE(timestamp)""")
+        conn.execute("""INSERT INTO daily_metrics (day, alerts)
+                        SELECT DATE(timestamp), COUNT(*) FROM alerts
+                        WHERE DATE(timestamp) IS NOT NULL GROUP BY DATE(timestamp)
+                        ON CONFLICT(day) DO UPDATE SET alerts = excluded.alerts""")
+        for name, query in RAW_TOTALS.items():
+            conn.execute("INSERT INTO metric_totals (name, value) VALUES (?, ?)",
+                         (name, conn.execute(query).fetchone()[0]))
+
+
+@timed("dashboard.totals")
+def read_totals(conn: sqlite3.Connection):
+    totals = dict.fromkeys(RAW_TOTALS, 0)
+    totals.update(conn.execute("SELECT name, value FROM metric_totals").fetchall())
+    return totals
+
+
+def check_consistency(conn: sqlite3.Connection):
+    """Return {name: (rollup, raw)} for every counter that has drifted."""
+    rollup = read_totals(conn)
+    mismatches = {}
+    for name, query in RAW_TOTALS.items():
+        raw = conn.execute(query).fetchone()[0]
+        if rollup[name] != raw:
+            mismatches[name] = (rollup[name], raw)
+    return mismatches
+
+
+def repair(conn: sqlite3.Connection):
+    """Rebuild the rollup if it has drifted from the raw tables; returns the mismatches found."""
+    mismatches = check_consistency(conn)
+    if mismatches:
+        backfill(conn)
+    return mismatches
@@ -0,0 +1,123 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import storage
+
+# ---------------------------
+# RESPONSE CACHE (memory LRU + SQLite)
+# ---------------------------
+# Farmers ask the same handful of questions over and over, so answers are kept
+# in a small in-process LRU backed by a SQLite table that survives restarts.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS response_cache
+    (key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL, last_access REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS idx_response_cache_last_access ON response_cache (last_access);
+"""
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s?.!।]+$")
+
+
+def normalize_prompt(prompt):
+    return _TRAILING_PUNCTUATION.sub("", _WHITESPACE.sub(" ", prompt.strip().lower()))
+
+
+def make_key(prompt, language, model_name):
+    raw = "\x1f".join([normalize_prompt(prompt), language.lower(), model_name])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path=storage.DB_PATH, memory_entries=512, max_rows=20000,
+                 ttl=7 * 24 * 3600, prune_every=200):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self.prune_every = prune_every
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts = 0
+        with storage.connection(path) as conn:
+            conn.executescript(SCHEMA)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry[1] <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                del self._memory[key]
+
+        with storage.connection(self.path) as conn:
+            row = conn.execute(
+                "SELECT response, created_at FROM response_cache WHERE key = ? AND created_at >= ?",
+                (key, now - self.ttl),
+            ).fetchone()
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._remember(key, row[0], row[1])
+        storage.writer(self.path).submit(
+            "UPDATE response_cache SET last_access = ? WHERE key = ?", (now, key)
+        )
+        return row[0]
+
+    def put(self, key, response):
+        now = time.time()
+        with self._lock:
+            self._remember(key, response, now)
+            self._puts += 1
+            prune = self._puts % self.prune_every == 0
+        write = storage.writer(self.path)
+        write.submit(
+            "INSERT OR REPLACE INTO response_cache (key, response, created_at, last_access) VALUES (?, ?, ?, ?)",
+            (key, response, now, now),
+        )
+        if prune:
+            self.prune(now)
+
+    def prune(self, now=None):
+        """Drop expired rows, then the least recently used beyond `max_rows`."""
+        now = time.time() if now is None else now
+        write = storage.writer(self.path)
+        write.submit("DELETE FROM response_cache WHERE created_at < ?", (now - self.ttl,))
+        write.submit(
+            """DELETE FROM response_cache WHERE key IN
+               (SELECT key FROM response_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)""",
+            (self.max_rows,),
+        )
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        storage.writer(self.path).submit("DELETE FROM response_cache")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+            }
+
+    def _remember(self, key, response, created_at):
+        self._memory[key] = (response, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
@@ -0,0 +1,168 @@
+import csv
+import io
+import itertools
+import os
+import time
+import uuid
+
+import numpy as np
+
+import storage
+
+# ---------------------------
+# SOIL HEALTH ENGINE
+# ---------------------------
+# Samples are classified in NumPy arrays, so the sidebar's single sample and a
+# lab export with tens of thousands of rows go through the same thresholds. Lab
+# CSVs are streamed in fixed-size chunks, keeping memory flat regardless of
+# file size.
+NUTRIENTS = ("nitrogen", "phosphorus", "potassium")
+THRESHOLD = 20
+CHUNK_ROWS = 10000
+
+HEALTHY, NEEDS_IMPROVEMENT, INVALID = "Healthy", "Needs Improvement", "Invalid"
+ADVICE = {
+    "MAINTAIN": "Maintain current practices",
+    "ORGANIC_MANURE": "Add organic manure",
+    "CHECK_SAMPLE": "Re-test sample: missing or invalid readings",
+}
+
+COLUMN_ALIASES = {
+    "nitrogen": ("nitrogen", "n", "n%", "nitrogen%", "nitrogen_pct"),
+    "phosphorus": ("phosphorus", "p", "p%", "phosphorus%", "phosphorus_pct"),
+    "potassium": ("potassium", "k", "k%", "potassium%", "potassium_pct"),
+    "sample_id": ("sample_id", "sample", "id", "sample no", "sample_no"),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS soil_results
+    (batch_id TEXT NOT NULL, row_no INTEGER NOT NULL, sample_id TEXT, nitrogen REAL, phosphorus REAL,
+     potassium REAL, health TEXT, deficient TEXT, advice_code TEXT, PRIMARY KEY (batch_id, row_no));
+"""
+
+
+def classify(npk):
+    """Classify an (n, 3) array of N/P/K readings.
+
+    Returns (health, deficient, advice_code) as arrays of strings; `deficient`
+    lists the nutrients at or below the threshold, e.g. "nitrogen,potassium".
+    """
+    npk = np.asarray(npk, dtype=np.float64).reshape(-1, 3)
+    invalid = np.isnan(npk).any(axis=1) | (npk < 0).any(axis=1)
+    low = npk <= THRESHOLD
+    any_low = low.any(axis=1)
+
+    health = np.where(invalid, INVALID, np.where(any_low, NEEDS_IMPROVEMENT, HEALTHY))
+    advice = np.where(invalid, "CHECK_SAMPLE", np.where(any_low, "ORGANIC_MANURE", "MAINTAIN"))
+    # Eight possible deficiency patterns: look them up by bitmask instead of joining per row.
+    patterns = np.array([",".join(n for bit, n in enumerate(NUTRIENTS) if mask >> bit & 1) for mask in range(8)])
+    masks = (low * np.array([1, 2, 4])).sum(axis=1)
+    deficient = np.where(invalid, "", patterns[masks])
+    return health, deficient, advice
+
+
+def _resolve_columns(header):
+    normalized = [h.strip().lower() for h in header]
+    columns = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in normalized:
+                columns[field] = normalized.index(alias)
+                break
+    missing = [n for n in NUTRIENTS if n not in columns]
+    if missing:
+        raise ValueError(f"Soil CSV is missing column(s): {', '.join(missing)}")
+    return columns
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def iter_chunks(source, chunk_rows=CHUNK_ROWS):
+    """Yield (sample_ids, npk array) chunks from a CSV path, text stream or upload."""
+    if isinstance(source, (str, os.PathLike)):
+        stream = open(source, encoding="utf-8-sig", newline="")
+        release = stream.close
+    elif isinstance(source, io.TextIOBase):
+        stream = source
+        release = None
+    else:
+        # Binary stream such as a Streamlit upload; detach afterwards so the
+        # caller's file object is left open.
+        stream = io.TextIOWrapper(source, encoding="utf-8-sig", newline="")
+        release = stream.detach
+    try:
+        reader = csv.reader(stream)
+        header = next(reader, None)
+        if header is None:
+            raise ValueError("Soil CSV is empty")
+        columns = _resolve_columns(header)
+        id_column = columns.get("sample_id")
+        nutrient_columns = [columns[n] for n in NUTRIENTS]
+        while True:
+            rows = list(itertools.islice(reader, chunk_rows))
+            if not rows:
+                return
+            npk = np.array([[_to_float(row[i]) if i < len(row) else np.nan for i in nutrient_columns] for row in rows])
+            ids = [row[id_column] if id_column is not None and id_column < len(row) else None for row in rows]
+            yield ids, npk
+    finally:
+        if release is not None:
+            release()
+
+
+def analyze_csv(source, output=None, chunk_rows=CHUNK_ROWS, on_chunk=None, db_path=storage.DB_PATH):
+    """Classify every sample in a soil-lab CSV.
+
+    Results go to `output` (a CSV path) when given, otherwise to the
+    soil_results table under a fresh batch_id. `on_chunk` is called after each
+    chunk with its row count, elapsed seconds and rows per second. Returns a
+    summary dict with the batch id and per-class counts.
+    """
+    batch_id = uuid.uuid4().hex[:12]
+    counts = {HEALTHY: 0, NEEDS_IMPROVEMENT: 0, INVALID: 0}
+    total_rows = 0
+    started = time.perf_counter()
+    out_file = writer = None
+    if output is not None:
+        out_file = open(output, "w", encoding="utf-8", newline="")
+        writer = csv.writer(out_file)
+        writer.writerow(["row_no", "sample_id", *NUTRIENTS, "health", "deficient", "advice_code"])
+    else:
+        with storage.connection(db_path) as conn:
+            conn.executescript(SCHEMA)
+    try:
+        chunk_started = time.perf_counter()
+        for ids, npk in iter_chunks(source, chunk_rows):
+            health, deficient, advice = classify(npk)
+            row_numbers = range(total_rows + 1, total_rows + len(ids) + 1)
+            rows = zip(row_numbers, ids, *npk.T.tolist(), health.tolist(), deficient.tolist(), advice.tolist())
+            if writer is not None:
+                writer.writerows(rows)
+            else:
+                with storage.connection(db_path) as conn, conn:
+                    conn.executemany("INSERT INTO soil_results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                     ((batch_id, *row) for row in rows))
+            labels, label_counts = np.unique(health, return_counts=True)
+            for label, count in zip(labels.tolist(), label_counts.tolist()):
+                counts[label] += count
+            total_rows += len(ids)
+            if on_chunk is not None:
+                elapsed = time.perf_counter() - chunk_started
+                on_chunk({"rows": len(ids), "seconds": elapsed, "rows_per_second": len(ids) / elapsed if elapsed else 0.0})
+            chunk_started = time.perf_counter()
+    finally:
+        if out_file is not None:
+            out_file.close()
+    elapsed = time.perf_counter() - started
+    return {"batch_id": batch_id, "rows": total_rows, "seconds": elapsed,
+            "rows_per_second": total_rows / elapsed if elapsed else 0.0, **counts}
+
+
+def analyze_sample(nitrogen, phosphorus, potassium):
+    health, deficient, advice = classify([[nitrogen, phosphorus, potassium]])
+    return {"health": str(health[0]), "deficient": str(deficient[0]), "advice_code": str(advice[0])}
@@ -0,0 +1,296 @@
+import atexit
+import queue
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
+from contextlib import contextmanager
+
+import metrics
+
+# ---------------------------
+# DATABASE OWNERSHIP
+# ---------------------------
+# One place that opens agrisense.db: schema is created once per process, reads
+# borrow a connection from a small pool, and chat/alert writes go through a
+# single background writer that group-commits them. A batch that still finds
+# the database locked after the busy timeout is retried with backoff; groups
+# that cannot be written are reported by the next flush().
+DB_PATH = "agrisense.db"
+POOL_SIZE = 4
+BUSY_TIMEOUT_MS = 5000
+BUSY_RETRIES = 4
+BUSY_BACKOFF = 0.25
+MAX_REPORTED_FAILURES = 100
+
+# Called as hook(duration_ms, writes) after every batch the writer commits.
+COMMIT_HOOKS = []
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chats
+    (id INTEGER PRIMARY KEY AUTOINCREMENT, message TEXT, role TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+     session_id TEXT);
+CREATE TABLE IF NOT EXISTS alerts
+    (id INTEGER PRIMARY KEY AUTOINCREMENT, alert_type TEXT, message TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP);
+"""
+
+
+class WriteFailed(sqlite3.Error):
+    """Raised by flush() when queued writes could not be committed."""
+
+    def __init__(self, failures):
+        self.failures = failures  # [(statements, error)], oldest first
+        super().__init__(f"{len(failures)} queued write(s) failed: {failures[-1][1]}")
+
+
+def is_busy(error):
+    """True for SQLITE_BUSY / SQLITE_LOCKED, which go away if the write is tried again later."""
+    name = getattr(error, "sqlite_errorname", "")
+    return (isinstance(error, sqlite3.OperationalError)
+            and (name.startswith(("SQLITE_BUSY", "SQLITE_LOCKED")) or "locked" in str(error)))
+
+
+def connect(path=DB_PATH):
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # WAL + NORMAL only syncs at checkpoints; a crash can lose the last batch but
+    # never corrupts the database.
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    return conn
+
+
+class ConnectionPool:
+    def __init__(self, path=DB_PATH, size=POOL_SIZE):
+        self.path = path
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self):
+        self._slots.acquire()
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = connect(self.path)
+            try:
+                yield conn
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
+                self._idle.put_nowait(conn)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class WriteBehindQueue:
+    """Background writer that commits queued statements in batches.
+
+    A batch is committed as soon as `max_batch` statements are waiting or the
+    oldest one has waited `max_latency` seconds, so one fsync covers every
+    session that wrote in that window.
+    """
+
+    def __init__(self, path=DB_PATH, max_batch=256, max_latency=0.05, busy_retries=BUSY_RETRIES,
+                 busy_backoff=BUSY_BACKOFF):
+        self.path = path
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.busy_retries = busy_retries
+        self.busy_backoff = busy_backoff
+        self.batches = 0
+        self.writes = 0
+        self.errors = 0
+        self.retries = 0
+        self._failures = deque(maxlen=MAX_REPORTED_FAILURES)  # not yet reported by a flush
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="agrisense-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, sql, params=()):
+        self.submit_group([(sql, params)])
+
+    def submit_group(self, writes):
+        """Queue statements that must commit together (e.g. a row and its dependants)."""
+        if self._closed:
+            raise RuntimeError("Write queue is closed")
+        self._queue.put((list(writes), None))
+
+    def flush(self, timeout=None):
+        """Block until everything submitted so far is written; False if `timeout` passes first.
+
+        Raises WriteFailed listing the groups that failed since the previous flush.
+        """
+        done = Future()
+        self._queue.put(([], done))
+        try:
+            failures = done.result(timeout)
+        except FutureTimeout:
+            return False
+        if failures:
+            raise WriteFailed(failures)
+        return True
+
+    def close(self, timeout=5):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _collect(self, first):
+        batch = [first]
+        if first is None:
+            return batch
+        deadline = time.monotonic() + self.max_latency
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(item)
+            if item is None:
+                break
+        return batch
+
+    def _execute(self, conn, groups):
+        for attempt in range(self.busy_retries + 1):
+            try:
+                with conn:
+                    for group in groups:
+                        for sql, params in group:
+                            conn.execute(sql, params)
+                return
+            except sqlite3.Error as e:
+                if not is_busy(e) or attempt == self.busy_retries:
+                    raise
+            self.retries += 1
+            time.sleep(self.busy_backoff * 2 ** attempt)
+
+    def _fail(self, group, error):
+        self.errors += 1
+        self._failures.append((group, error))
+
+    def _commit(self, conn, groups):
+        started = time.perf_counter()
+        try:
+            self._execute(conn, groups)
+        except sqlite3.Error as e:
+            if is_busy(e):
+                # Still locked after every retry: replaying group by group would only wait again.
+                for group in groups:
+                    self._fail(group, e)
+            else:
+                # Replay group by group so a single bad row doesn't drop the whole batch.
+                for group in groups:
+                    try:
+                        self._execute(conn, [group])
+                    except sqlite3.Error as group_error:
+                        self._fail(group, group_error)
+        self.batches += 1
+        writes = sum(len(group) for group in groups)
+        self.writes += writes
+        duration_ms = (time.perf_counter() - started) * 1000
+        for hook in COMMIT_HOOKS:
+            try:
+                hook(duration_ms, writes)
+            except Exception:
+                pass  # Instrumentation must never stop the writer.
+
+    def _run(self):
+        conn = connect(self.path)
+        try:
+            while True:
+                batch = self._collect(self._queue.get())
+                groups = [item[0] for item in batch if item is not None and item[0]]
+                if groups:
+                    self._commit(conn, groups)
+                for item in batch:
+                    if item is not None and item[1] is not None:
+                        failures, self._failures = list(self._failures), deque(maxlen=MAX_REPORTED_FAILURES)
+                        item[1].set_result(failures)
+                if batch[-1] is None:
+                    return
+        finally:
+            conn.close()
+
+
+_lock = threading.Lock()
+_pools = {}
+_writers = {}
+
+
+def _migrate(conn):
+    # Databases created before chats were tagged with the browser session that wrote them.
+    if "session_id" not in [row[1] for row in conn.execute("PRAGMA table_info(chats)")]:
+        conn.execute("ALTER TABLE chats ADD COLUMN session_id TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chats_session ON chats (session_id, id)")
+
+
+def init_db(path=DB_PATH):
+    """Create the schema, rollup triggers and writer for `path` once per process."""
+    if path in _pools:
+        return
+    with _lock:
+        if path in _pools:
+            return
+        conn = connect(path)
+        try:
+            conn.executescript(SCHEMA)
+            _migrate(conn)
+            metrics.install(conn)
+        finally:
+            conn.close()
+        _pools[path] = ConnectionPool(path)
+        _writers[path] = WriteBehindQueue(path)
+
+
+@contextmanager
+def connection(path=DB_PATH):
+    init_db(path)
+    with _pools[path].connection() as conn:
+        yield conn
+
+
+def writer(path=DB_PATH):
+    init_db(path)
+    return _writers[path]
+
+
+def record_chat(role, message, path=DB_PATH, session_id=None):
+    writer(path).submit("INSERT INTO chats (message, role, session_id) VALUES (?, ?, ?)", (message, role, session_id))
+
+
+def record_alert(alert_type, message, path=DB_PATH):
+    writer(path).submit("INSERT INTO alerts (alert_type, message) VALUES (?, ?)", (alert_type, message))
+
+
+def flush(path=DB_PATH, timeout=5):
+    """Wait for queued writes to `path`; raises WriteFailed if any could not be committed."""
+    return writer(path).flush(timeout)
+
+
+@atexit.register
+def shutdown():
+    """Drain every writer and close pooled connections."""
+    with _lock:
+        for w in _writers.values():
+            w.close()
+        for pool in _pools.values():
+            pool.close()
+        _writers.clear()
+        _pools.clear()
@@ -0,0 +1,36 @@
+import re
+
+# ---------------------------
+# SENTENCE SPLITTING FOR STREAMED TEXT
+# ---------------------------
+# Streamed answers arrive in arbitrary chunks; speech wants whole sentences.
+# A sentence ends at . ! ? (followed by whitespace, so "0.6 gm" stays intact)
+# or at the Devanagari danda / CJK full stop, which need no trailing space.
+_SENTENCE_END = re.compile(r"(?:[.!?]+[\"')\]]*(?=\s)|[।॥。！？])")
+
+
+class SentenceSplitter:
+    def __init__(self, min_length=12):
+        self.min_length = min_length
+        self._buffer = ""
+
+    def feed(self, text):
+        """Add a chunk and return the sentences it completed."""
+        self._buffer += text
+        sentences = []
+        start = 0
+        for match in _SENTENCE_END.finditer(self._buffer):
+            end = match.end()
+            # Don't hand very short fragments ("1." in a numbered list) to TTS on their own.
+            if len(self._buffer[start:end].strip()) < self.min_length:
+                continue
+            sentences.append(self._buffer[start:end].strip())
+            start = end
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self):
+        """Return whatever is left once the stream is finished."""
+        rest = self._buffer.strip()
+        self._buffer = ""
+        return [rest] if rest else []
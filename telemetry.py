@@ -0,0 +1,171 @@
+import math
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import ContextDecorator
+
+# ---------------------------
+# LATENCY TELEMETRY
+# ---------------------------
+# `timed(stage)` wraps a hot path (as a decorator or a `with` block) and records
+# how long it took. Samples are kept in a per-stage ring buffer for the admin
+# panel and written to stage_timings in small batches through the write-behind
+# queue, so timing a stage never adds a commit to it. Only the latest
+# KEEP_PER_STAGE rows of each stage are kept. `storage` is imported lazily
+# because storage's own modules are timed with this one.
+FLUSH_EVERY = 50
+FLUSH_SECONDS = 5.0
+RECENT_SAMPLES = 1000
+KEEP_PER_STAGE = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stage_timings
+    (id INTEGER PRIMARY KEY AUTOINCREMENT, stage TEXT NOT NULL, duration_ms REAL NOT NULL, recorded_at REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS idx_stage_timings_stage ON stage_timings (stage, id);
+"""
+
+
+def _trim(stage):
+    """Delete all but the newest KEEP_PER_STAGE rows of `stage` (a range delete on the (stage, id) index)."""
+    return ("""DELETE FROM stage_timings WHERE stage = ? AND id <=
+               (SELECT id FROM stage_timings WHERE stage = ? ORDER BY id DESC LIMIT 1 OFFSET ?)""",
+            (stage, stage, KEEP_PER_STAGE))
+
+
+class Recorder:
+    def __init__(self, db_path=None, persist=True):
+        self.db_path = db_path
+        self.persist = persist
+        self._recent = defaultdict(lambda: deque(maxlen=RECENT_SAMPLES))
+        self._pending = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._installed = False
+        self._stages = set()  # every stage that has rows in stage_timings
+
+    def record(self, stage, duration_ms):
+        with self._lock:
+            self._recent[stage].append(duration_ms)
+            self._stages.add(stage)
+            if not self.persist:
+                return
+            self._pending.append((stage, duration_ms, time.time()))
+            due = len(self._pending) >= FLUSH_EVERY or time.monotonic() - self._last_flush >= FLUSH_SECONDS
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+        import storage
+        path = self._install()
+        writes = [("INSERT INTO stage_timings (stage, duration_ms, recorded_at) VALUES (?, ?, ?)", row)
+                  for row in pending]
+        # Trim the stages just written back to their newest KEEP_PER_STAGE rows.
+        writes.extend(_trim(stage) for stage in {row[0] for row in pending})
+        storage.writer(path).submit_group(writes)
+
+    def _install(self):
+        import storage
+        path = self.db_path or storage.DB_PATH
+        if not self._installed:
+            with storage.connection(path) as conn:
+                conn.executescript(SCHEMA)
+                stages = [row[0] for row in conn.execute("SELECT DISTINCT stage FROM stage_timings")]
+            with self._lock:
+                self._stages.update(stages)
+            # Tables written before retention existed are trimmed once.
+            storage.writer(path).submit_group([_trim(stage) for stage in stages])
+            self._installed = True
+        return path
+
+    def recent(self):
+        """{stage: [durations]} from this process's ring buffers."""
+        with self._lock:
+            return {stage: list(samples) for stage, samples in self._recent.items()}
+
+    def stored(self, per_stage=RECENT_SAMPLES):
+        """{stage: [durations]} for the latest `per_stage` samples of each stage in the database."""
+        import storage
+        path = self._install()
+        with self._lock:
+            stages = sorted(self._stages)
+        with storage.connection(path) as conn:
+            return {
+                stage: [row[0] for row in conn.execute(
+                    "SELECT duration_ms FROM stage_timings WHERE stage = ? ORDER BY id DESC LIMIT ?",
+                    (stage, per_stage))]
+                for stage in stages
+            }
+
+
+def percentile(samples, q):
+    """Nearest-rank percentile of a list of numbers (q in 0..100)."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = max(1, min(len(ordered), math.ceil(q / 100 * len(ordered))))
+    return ordered[rank - 1]
+
+
+def summarize(samples_by_stage):
+    """[(stage, count, p50, p95)] sorted by stage name."""
+    return [(stage, len(samples), percentile(samples, 50), percentile(samples, 95))
+            for stage, samples in sorted(samples_by_stage.items()) if samples]
+
+
+class timed(ContextDecorator):
+    """Time a block or function under `stage`: `with timed("llm.generate"):` or `@timed("history.sync")`."""
+
+    def __init__(self, stage, recorder=None):
+        self.stage = stage
+        self.recorder = recorder
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        (self.recorder or get_recorder()).record(self.stage, (time.perf_counter() - self._started) * 1000)
+        return False
+
+    def _recreate_cm(self):
+        # A fresh timer per call, so concurrent calls of a decorated function don't share _started.
+        return timed(self.stage, self.recorder)
+
+
+def _record_commit(duration_ms, writes):
+    get_recorder().record("db.commit", duration_ms)
+
+
+def _hook_commits():
+    # The writer thread reports every batch commit; recording one only queues a
+    # row, and rows are flushed in batches, so this can't turn into a commit per
+    # commit.
+    import storage
+    if _record_commit not in storage.COMMIT_HOOKS:
+        storage.COMMIT_HOOKS.append(_record_commit)
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def get_recorder():
+    global _recorder
+    with _recorder_lock:
+        if _recorder is None:
+            _hook_commits()
+            _recorder = Recorder()
+        return _recorder
+
+
+def set_recorder(recorder):
+    """Swap the process-wide recorder (e.g. to keep benchmark samples in memory only)."""
+    global _recorder
+    with _recorder_lock:
+        _hook_commits()
+        _recorder = recorder
@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import storage  # noqa: E402
+import telemetry  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def memory_recorder():
+    # Timed functions must not write stage_timings into agrisense.db in the working directory.
+    telemetry.set_recorder(telemetry.Recorder(persist=False))
+    yield
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "test.db")
+    storage.init_db(path)
+    yield path
+    storage.flush(path)
@@ -0,0 +1,91 @@
+import smtplib
+import time
+
+import alerts
+import storage
+
+
+class StubSMTP:
+    """smtplib.SMTP stand-in that records what would have been sent."""
+
+    sent = []
+    fail_with = None
+
+    def __init__(self, server, port, timeout=None):
+        self.server = server
+        self.port = port
+
+    def starttls(self):
+        pass
+
+    def login(self, user, password):
+        pass
+
+    def sendmail(self, sender, recipients, message):
+        if StubSMTP.fail_with is not None:
+            raise StubSMTP.fail_with
+        StubSMTP.sent.append((sender, recipients, message))
+
+    def quit(self):
+        pass
+
+
+CONFIG = alerts.SmtpConfig("localhost", 25, "alerts@agrisense.test", "secret")
+
+
+def make_dispatcher(db_path, **kwargs):
+    StubSMTP.sent = []
+    StubSMTP.fail_with = None
+    return alerts.AlertDispatcher(CONFIG, db_path=db_path, smtp_factory=StubSMTP, **kwargs)
+
+
+def test_alerts_are_sent_as_one_digest_per_recipient(db_path):
+    dispatcher = make_dispatcher(db_path)
+    for i in range(30):
+        alerts.queue_alert("weather", f"Heavy rain expected ({i})", recipient=f"farmer{i % 3}@example.com",
+                           db_path=db_path)
+    storage.flush(db_path)
+
+    assert dispatcher.dispatch_once(now=time.time()) == 0  # still inside the coalescing window
+    assert dispatcher.dispatch_once(now=time.time() + alerts.COALESCE_SECONDS + 1) == 30
+
+    assert len(StubSMTP.sent) == 3
+    assert sorted(recipients[0] for _, recipients, _ in StubSMTP.sent) == [
+        "farmer0@example.com", "farmer1@example.com", "farmer2@example.com"]
+    assert all("Alert Digest (10 alerts)" in message for _, _, message in StubSMTP.sent)
+    assert dispatcher.status_counts() == {"sent": 30}
+
+
+def test_alert_without_recipient_is_only_recorded(db_path):
+    dispatcher = make_dispatcher(db_path)
+    alerts.queue_alert("weather", "Frost tonight", db_path=db_path)
+    storage.flush(db_path)
+    assert dispatcher.dispatch_once(now=time.time() + 3600) == 0
+    with storage.connection(db_path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM alerts").fetchone()[0] == 1
+
+
+def test_failed_sends_back_off_then_fail(db_path):
+    dispatcher = make_dispatcher(db_path, max_attempts=2, backoff_base=30)
+    alerts.queue_alert("weather", "Hailstorm", recipient="farmer@example.com", db_path=db_path)
+    storage.flush(db_path)
+    StubSMTP.fail_with = smtplib.SMTPRecipientsRefused({"farmer@example.com": (550, b"no such user")})
+
+    now = time.time() + alerts.COALESCE_SECONDS + 1
+    assert dispatcher.dispatch_once(now=now) == 1
+    assert dispatcher.status_counts() == {"pending": 1}
+    assert dispatcher.dispatch_once(now=now + 1) == 0  # backing off
+    assert dispatcher.dispatch_once(now=now + 31) == 1
+    assert dispatcher.status_counts() == {"failed": 1}
+    assert dispatcher.failed == 1
+
+
+def test_unreachable_server_keeps_alerts_pending(db_path):
+    def refuse(*args, **kwargs):
+        raise ConnectionRefusedError("connection refused")
+
+    dispatcher = alerts.AlertDispatcher(CONFIG, db_path=db_path, smtp_factory=refuse)
+    alerts.queue_alert("weather", "Cyclone warning", recipient="farmer@example.com", db_path=db_path)
+    storage.flush(db_path)
+    assert dispatcher.dispatch_once(now=time.time() + alerts.COALESCE_SECONDS + 1) == 1
+    assert dispatcher.status_counts() == {"pending": 1}
@@ -0,0 +1,165 @@
+import threading
+import time
+
+import pytest
+
+import llm
+from gateway import GatewayBusy, LLMGateway
+
+
+class RateLimited(Exception):
+    code = 429
+
+
+class Reply:
+    def __init__(self, text):
+        self.text = text
+
+
+class StubModel:
+    """Gemini stand-in: echoes the prompt, optionally failing the first calls with a 429."""
+
+    def __init__(self, latency=0.0, throttle_first=0):
+        self.latency = latency
+        self.throttle_first = throttle_first
+        self.prompts = []
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, stream=False):
+        with self._lock:
+            self.prompts.append(prompt)
+            throttled = len(self.prompts) <= self.throttle_first
+        time.sleep(self.latency)
+        if throttled:
+            raise RateLimited("429 quota exceeded")
+        if stream:
+            return iter([Reply("Water "), Reply("early.")])
+        return Reply(f"answer {len(self.prompts)}")
+
+
+class MemoryCache:
+    ttl = 60
+
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, value):
+        self.entries[key] = value
+
+
+def make_gateway(**kwargs):
+    options = dict(requests_per_minute=60_000, burst=1000, backoff_base=0.001, backoff_max=0.01)
+    options.update(kwargs)
+    return LLMGateway(**options)
+
+
+def test_identical_calls_share_one_upstream_request():
+    gateway = make_gateway()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        time.sleep(0.1)
+        return "shared"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(gateway.call(fetch, key="same"))) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ["shared"] * 10
+    assert len(calls) == 1
+    assert gateway.stats()["coalesced"] == 9
+    assert gateway.stats()["in_flight_keys"] == 0
+
+
+def test_rate_limited_calls_are_retried():
+    gateway = make_gateway()
+    model = StubModel(throttle_first=2)
+    assert gateway.call(lambda: model.generate_content("q").text) == "answer 3"
+    stats = gateway.stats()
+    assert (stats["upstream_calls"], stats["retries"], stats["throttled"]) == (3, 2, 2)
+
+
+def test_retries_give_up_after_max_retries():
+    gateway = make_gateway(max_retries=1)
+    model = StubModel(throttle_first=5)
+    with pytest.raises(RateLimited):
+        gateway.call(lambda: model.generate_content("q"))
+    assert len(model.prompts) == 2
+
+
+def test_other_errors_are_not_retried():
+    gateway = make_gateway()
+    calls = []
+
+    def fail():
+        calls.append(1)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        gateway.call(fail)
+    assert len(calls) == 1
+
+
+def test_full_queue_raises_gateway_busy():
+    gateway = make_gateway(max_concurrency=1, queue_timeout=0.05)
+    release = threading.Event()
+    holder = threading.Thread(target=lambda: gateway.call(release.wait))
+    holder.start()
+    time.sleep(0.02)
+    try:
+        with pytest.raises(GatewayBusy):
+            gateway.call(lambda: "never")
+    finally:
+        release.set()
+        holder.join()
+    assert gateway.stats()["rejected"] == 1
+
+
+def test_stream_retries_before_the_first_chunk():
+    gateway = make_gateway()
+    model = StubModel(throttle_first=1)
+    chunks = [chunk.text for chunk in gateway.stream(lambda: model.generate_content("q", stream=True))]
+    assert chunks == ["Water ", "early."]
+    assert gateway.stats()["retries"] == 1
+
+
+def test_standalone_questions_share_a_cache_entry():
+    model, cache, gateway = StubModel(), MemoryCache(), make_gateway()
+    first = llm.get_ai_response("Best time to sow wheat?", "English", model, cache, gateway=gateway)
+    second = llm.get_ai_response("best time to sow wheat", "English", model, cache, gateway=gateway)
+    assert first == second
+    assert len(model.prompts) == 1
+
+
+def test_conversation_is_part_of_the_cache_key():
+    model, cache, gateway = StubModel(), MemoryCache(), make_gateway()
+    about_rice = [("user", "My rice leaves are yellow"), ("assistant", "Check nitrogen.")]
+    about_cotton = [("user", "Bollworms in my cotton"), ("assistant", "Use pheromone traps.")]
+    llm.get_ai_response("What else?", "English", model, cache, turns=about_rice, gateway=gateway)
+    llm.get_ai_response("What else?", "English", model, cache, turns=about_cotton, gateway=gateway)
+    llm.get_ai_response("What else?", "English", model, cache, turns=about_rice, gateway=gateway)
+    assert len(model.prompts) == 2
+    assert "yellow" in model.prompts[0] and "Bollworms" in model.prompts[1]
+
+
+def test_changed_references_miss_the_cache():
+    model, cache, gateway = StubModel(), MemoryCache(), make_gateway()
+    old_prices = ["Rice (Kochi): ₹2,100/quintal"]
+    new_prices = ["Rice (Kochi): ₹2,450/quintal"]
+    llm.get_ai_response("Rice price today?", "English", model, cache, context=old_prices, gateway=gateway)
+    llm.get_ai_response("Rice price today?", "English", model, cache, context=old_prices, gateway=gateway)
+    llm.get_ai_response("Rice price today?", "English", model, cache, context=new_prices, gateway=gateway)
+    assert len(model.prompts) == 2
+    assert "2,450" in model.prompts[1]
+
+def test_stream_caches_the_full_answer():
+    model, cache, gateway = StubModel(), MemoryCache(), make_gateway()
+    assert "".join(llm.stream_ai_response("Irrigation?", "English", model, cache, gateway=gateway)) == "Water early."
+    assert "".join(llm.stream_ai_response("Irrigation?", "English", model, cache, gateway=gateway)) == "Water early."
+    assert len(model.prompts) == 1
@@ -0,0 +1,72 @@
+import history
+import storage
+
+
+class SessionState(dict):
+    """Minimal st.session_state: a dict that also takes attribute access."""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+
+def add_chats(db_path, count, start=0):
+    with storage.connection(db_path) as conn, conn:
+        conn.executemany(
+            "INSERT INTO chats (message, role) VALUES (?, ?)",
+            [(f"message {i}", "user" if i % 2 == 0 else "assistant") for i in range(start, start + count)],
+        )
+
+
+def contents(state):
+    return [m["content"] for m in state.messages]
+
+
+def test_sync_loads_the_latest_page(db_path):
+    add_chats(db_path, 7)
+    state = SessionState()
+    with storage.connection(db_path) as conn:
+        history.sync(state, conn, page_size=3)
+    assert contents(state) == ["message 4", "message 5", "message 6"]
+    assert state.history_has_more
+    assert state.history_newest_id == state.messages[-1]["id"]
+
+
+def test_sync_on_an_empty_table(db_path):
+    state = SessionState()
+    with storage.connection(db_path) as conn:
+        history.sync(state, conn)
+        assert state.messages == [] and state.history_oldest_id is None and not state.history_has_more
+        add_chats(db_path, 2)
+        history.sync(state, conn)
+    assert contents(state) == ["message 0", "message 1"]
+    assert state.history_oldest_id == state.messages[0]["id"]
+
+
+def test_sync_appends_only_new_rows(db_path):
+    add_chats(db_path, 3)
+    state = SessionState()
+    with storage.connection(db_path) as conn:
+        history.sync(state, conn)
+        add_chats(db_path, 2, start=3)
+        history.sync(state, conn)
+        history.sync(state, conn)
+    assert contents(state) == [f"message {i}" for i in range(5)]
+
+
+def test_load_earlier_pages_back_to_the_first_message(db_path):
+    add_chats(db_path, 7)
+    state = SessionState()
+    with storage.connection(db_path) as conn:
+        history.sync(state, conn, page_size=3)
+        history.load_earlier(state, conn, page_size=3)
+        assert contents(state) == [f"message {i}" for i in range(1, 7)]
+        assert state.history_has_more
+        history.load_earlier(state, conn, page_size=3)
+    assert contents(state) == [f"message {i}" for i in range(7)]
+    assert not state.history_has_more
@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+import knowledge
+
+ENTRIES = {
+    "rice blast": "Spray tricyclazole at 0.6 g/L at boot stage.",
+    "coconut mite": "Spray neem oil 2% on the bunches.",
+    "banana leaf spot": "Remove affected leaves and spray propiconazole 1 ml/L.",
+}
+
+
+@pytest.fixture
+def index(tmp_path):
+    path = tmp_path / "knowledge_base.json"
+    path.write_text(json.dumps(ENTRIES), encoding="utf-8")
+    return knowledge.KnowledgeIndex(str(path), check_interval=0)
+
+
+@pytest.mark.parametrize("question", ["banana leef spot", "How to treat banana leef spot?"])
+def test_misspelt_question_is_answered_locally(index, question):
+    match = index.best_answer(question)
+    assert match is not None and match.key == "banana leaf spot"
+
+
+@pytest.mark.parametrize("question", [
+    "Is it too late to sow rice? Last year blast hit my field",
+    "How much does coconut cost? mite be cheap",
+])
+def test_question_that_only_mentions_an_entry_goes_to_gemini(index, question):
+    assert index.best_answer(question) is None
+    # Still useful as a reference line for Gemini.
+    assert index.lookup(question)
+
+
+def test_broken_file_keeps_the_last_good_entries(index, tmp_path):
+    (tmp_path / "knowledge_base.json").write_text("{not json", encoding="utf-8")
+    assert not index.maybe_reload(force=True)
+    assert index.error
+    assert len(index) == len(ENTRIES)
+    assert not index.maybe_reload(force=True)
+
+
+def test_reload_picks_up_changed_entries(index, tmp_path):
+    entries = dict(ENTRIES, **{"tomato leaf curl": "Control whiteflies with yellow sticky traps."})
+    del entries["coconut mite"]
+    (tmp_path / "knowledge_base.json").write_text(json.dumps(entries), encoding="utf-8")
+    assert index.maybe_reload(force=True)
+    assert index.best_answer("tomato leaf curl").key == "tomato leaf curl"
+    assert index.best_answer("coconut mite") is None
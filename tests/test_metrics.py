@@ -0,0 +1,62 @@
+import metrics
+import storage
+
+
+def insert_chats(db_path, rows):
+    with storage.connection(db_path) as conn, conn:
+        conn.executemany("INSERT INTO chats (message, role, timestamp) VALUES (?, ?, ?)", rows)
+
+
+def test_rollup_follows_inserts_and_deletes(db_path):
+    insert_chats(db_path, [
+        ("q1", "user", "2025-09-01 10:00:00"),
+        ("a1", "assistant", "2025-09-01 10:00:05"),
+        ("q2", "user", "2025-09-02 08:00:00"),
+    ])
+    storage.record_alert("weather", "Rain", path=db_path)
+    storage.flush(db_path)
+    with storage.connection(db_path) as conn:
+        assert metrics.read_totals(conn) == {"queries_solved": 1, "weather_alerts": 1, "active_days": 2}
+        with conn:
+            conn.execute("DELETE FROM chats WHERE message = 'q2'")
+            conn.execute("DELETE FROM alerts")
+        assert metrics.read_totals(conn) == {"queries_solved": 1, "weather_alerts": 0, "active_days": 1}
+        assert metrics.check_consistency(conn) == {}
+
+
+def test_rollup_follows_updates(db_path):
+    insert_chats(db_path, [
+        ("q1", "user", "2025-09-01 10:00:00"),
+        ("a1", "assistant", "2025-09-01 10:00:05"),
+    ])
+    with storage.connection(db_path) as conn:
+        with conn:
+            conn.execute("UPDATE chats SET role = 'user' WHERE message = 'a1'")
+            conn.execute("UPDATE chats SET timestamp = '2025-09-03 09:00:00' WHERE message = 'q1'")
+        assert metrics.read_totals(conn) == {"queries_solved": 0, "weather_alerts": 0, "active_days": 2}
+        assert metrics.check_consistency(conn) == {}
+        with conn:
+            conn.execute("UPDATE chats SET timestamp = '2025-09-01 11:00:00' WHERE message = 'q1'")
+        assert metrics.read_totals(conn)["active_days"] == 1
+        assert metrics.check_consistency(conn) == {}
+
+
+def test_repair_rebuilds_a_drifted_rollup(db_path):
+    insert_chats(db_path, [("a1", "assistant", "2025-09-01 10:00:05")])
+    with storage.connection(db_path) as conn:
+        with conn:
+            conn.execute("UPDATE metric_totals SET value = 42 WHERE name = 'queries_solved'")
+        assert metrics.repair(conn) == {"queries_solved": (42, 1)}
+        assert metrics.repair(conn) == {}
+        assert metrics.read_totals(conn)["queries_solved"] == 1
+
+
+def test_install_backfills_existing_rows(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    conn = storage.connect(path)
+    conn.executescript(storage.SCHEMA)
+    conn.execute("INSERT INTO chats (message, role, timestamp) VALUES ('a', 'assistant', '2025-09-01 10:00:00')")
+    conn.commit()
+    metrics.install(conn)
+    assert metrics.read_totals(conn) == {"queries_solved": 1, "weather_alerts": 0, "active_days": 1}
+    conn.close()
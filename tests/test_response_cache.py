@@ -0,0 +1,71 @@
+import time
+
+import storage
+from response_cache import ResponseCache, make_key
+
+
+def keys_on_disk(path):
+    with storage.connection(path) as conn:
+        return {row[0] for row in conn.execute("SELECT key FROM response_cache")}
+
+
+def test_key_ignores_case_spacing_and_trailing_punctuation():
+    assert make_key("Best time to sow  wheat?", "English", "m") == make_key("best time to sow wheat", "english", "m")
+    assert make_key("best time to sow wheat", "Hindi", "m") != make_key("best time to sow wheat", "English", "m")
+
+
+def test_memory_keeps_the_most_recently_used_entries(db_path):
+    cache = ResponseCache(db_path, memory_entries=2)
+    cache.put("a", "answer a")
+    cache.put("b", "answer b")
+    assert cache.get("a") == "answer a"
+    cache.put("c", "answer c")  # evicts b, the least recently used
+    storage.flush(db_path)
+    assert cache.stats()["memory_entries"] == 2
+    assert cache.get("b") == "answer b"
+    assert (cache.hits, cache.disk_hits, cache.misses) == (2, 1, 0)
+
+
+def test_new_instance_reads_answers_from_disk(db_path):
+    ResponseCache(db_path).put("a", "answer a")
+    storage.flush(db_path)
+    cache = ResponseCache(db_path)
+    assert cache.get("a") == "answer a"
+    assert cache.get("missing") is None
+    assert cache.stats() == {"hits": 1, "disk_hits": 1, "misses": 1, "hit_rate": 0.5, "memory_entries": 1}
+
+
+def test_expired_answers_are_not_served(db_path):
+    cache = ResponseCache(db_path, ttl=0.2)
+    cache.put("a", "answer a")
+    storage.flush(db_path)
+    assert cache.get("a") == "answer a"
+    time.sleep(0.3)
+    assert cache.get("a") is None
+    assert ResponseCache(db_path, ttl=0.2).get("a") is None
+
+
+def test_prune_drops_expired_then_least_recently_used_rows(db_path):
+    cache = ResponseCache(db_path, max_rows=2)
+    for key in ["a", "b", "c"]:
+        cache.put(key, f"answer {key}")
+        time.sleep(0.01)
+    storage.flush(db_path)
+    # A disk hit from a fresh instance refreshes a's last_access.
+    assert ResponseCache(db_path).get("a") == "answer a"
+    cache.prune()
+    storage.flush(db_path)
+    assert keys_on_disk(db_path) == {"a", "c"}
+    cache.ttl = 0
+    cache.prune(time.time() + 1)
+    storage.flush(db_path)
+    assert keys_on_disk(db_path) == set()
+
+
+def test_put_prunes_every_prune_every_writes(db_path):
+    cache = ResponseCache(db_path, max_rows=3, prune_every=5)
+    for i in range(5):
+        cache.put(f"k{i}", "answer")
+        time.sleep(0.01)
+    storage.flush(db_path)
+    assert keys_on_disk(db_path) == {"k2", "k3", "k4"}
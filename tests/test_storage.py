@@ -0,0 +1,66 @@
+import threading
+
+import pytest
+
+import storage
+
+
+def count_chats(path):
+    with storage.connection(path) as conn:
+        return conn.execute("SELECT COUNT(*) FROM chats").fetchone()[0]
+
+
+def test_writes_are_committed_by_flush(db_path):
+    for i in range(10):
+        storage.record_chat("user", f"question {i}", path=db_path, session_id="s1")
+    assert storage.flush(db_path)
+    assert count_chats(db_path) == 10
+
+
+def test_failed_group_is_reported_and_the_rest_committed(db_path):
+    storage.record_chat("user", "kept", path=db_path)
+    storage.writer(db_path).submit("INSERT INTO no_such_table VALUES (?)", (1,))
+    storage.record_chat("assistant", "also kept", path=db_path)
+    with pytest.raises(storage.WriteFailed) as failed:
+        storage.flush(db_path)
+    assert [group for group, _ in failed.value.failures] == [[("INSERT INTO no_such_table VALUES (?)", (1,))]]
+    assert count_chats(db_path) == 2
+    # Each failure is reported once.
+    assert storage.flush(db_path)
+
+
+@pytest.fixture
+def locked_db(db_path, monkeypatch):
+    monkeypatch.setattr(storage, "BUSY_TIMEOUT_MS", 50)
+    holder = storage.connect(db_path)
+    holder.execute("BEGIN IMMEDIATE")
+    yield db_path, holder
+    if holder.in_transaction:
+        holder.rollback()
+    holder.close()
+
+
+def test_locked_database_is_retried(locked_db):
+    path, holder = locked_db
+    write = storage.WriteBehindQueue(path, busy_retries=6, busy_backoff=0.05)
+    try:
+        write.submit("INSERT INTO chats (message, role) VALUES (?, ?)", ("while locked", "user"))
+        threading.Timer(0.3, holder.rollback).start()
+        assert write.flush(timeout=10)
+        assert write.retries >= 1
+        assert count_chats(path) == 1
+    finally:
+        write.close()
+
+
+def test_database_locked_past_every_retry_fails_the_group(locked_db):
+    path, _ = locked_db
+    write = storage.WriteBehindQueue(path, busy_retries=1, busy_backoff=0.01)
+    try:
+        write.submit("INSERT INTO chats (message, role) VALUES (?, ?)", ("lost", "user"))
+        with pytest.raises(storage.WriteFailed) as failed:
+            write.flush(timeout=10)
+        assert storage.is_busy(failed.value.failures[0][1])
+        assert write.errors == 1
+    finally:
+        write.close()
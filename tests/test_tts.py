@@ -0,0 +1,55 @@
+from collections import namedtuple
+
+import tts
+
+Voice = namedtuple("Voice", ["id", "name", "languages"])
+
+SAPI_VOICES = [
+    Voice(r"HKEY_LOCAL_MACHINE\SOFTWARE\Microsoft\Speech\Voices\Tokens\TTS_MS_EN-US_ZIRA_11.0",
+          "Microsoft Zira Desktop - English (United States)", []),
+    Voice(r"HKEY_LOCAL_MACHINE\SOFTWARE\Microsoft\Speech\Voices\Tokens\TTS_MS_HI-IN_KALPANA_11.0",
+          "Microsoft Kalpana Desktop - Hindi", []),
+]
+ESPEAK_VOICES = [
+    Voice("gmw/en", "English (Great Britain)", [b"\x02en-gb", b"\x02en"]),
+    Voice("dra/te", "Telugu", [b"\x05te"]),
+]
+
+
+class StubEngine:
+    def __init__(self, voices):
+        self.properties = {"voices": voices}
+
+    def getProperty(self, name):
+        return self.properties.get(name)
+
+    def setProperty(self, name, value):
+        self.properties[name] = value
+
+
+def selected(voices, language):
+    engine = StubEngine(voices)
+    tts.select_voice(engine, language)
+    return engine.properties.get("voice")
+
+
+def test_sapi_voices_match_on_the_token_name_not_the_registry_path():
+    assert selected(SAPI_VOICES, "Hindi") == SAPI_VOICES[1].id
+    assert selected(SAPI_VOICES, "English") == SAPI_VOICES[0].id
+    assert selected(SAPI_VOICES, "Telugu") is None
+
+
+def test_espeak_voices_match_on_language_tags():
+    assert selected(ESPEAK_VOICES, "Telugu") == "dra/te"
+    assert selected(ESPEAK_VOICES, "English") == "gmw/en"
+    assert selected(ESPEAK_VOICES, "Hindi") is None
+
+
+def test_failed_engine_fails_every_request(tmp_path):
+    def broken():
+        raise OSError("espeak not installed")
+
+    worker = tts.TTSWorker(cache_dir=str(tmp_path), engine_factory=broken)
+    worker._thread.join(timeout=5)
+    future = worker.submit("Water the field in the evening.")
+    assert "espeak not installed" in str(future.exception(timeout=1))
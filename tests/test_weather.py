@@ -0,0 +1,150 @@
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import storage
+import weather
+
+
+class StubWeatherAPI(BaseHTTPRequestHandler):
+    """OpenWeatherMap stand-in: "Nowhere" is a 404, "Garbled" returns bad JSON, "Slowtown" never answers in time."""
+
+    latency = 0.0
+    requests = []
+
+    def do_GET(self):
+        city = parse_qs(urlparse(self.path).query)["q"][0]
+        StubWeatherAPI.requests.append(city)
+        time.sleep(5 if city == "Slowtown" else StubWeatherAPI.latency)
+        if city == "Nowhere":
+            self.send_response(404)
+            body = b'{"cod": "404", "message": "city not found"}'
+        elif city == "Garbled":
+            self.send_response(200)
+            body = b"<html>maintenance</html>"
+        else:
+            self.send_response(200)
+            body = json.dumps({"weather": [{"description": "light rain"}],
+                               "main": {"temp": 27.5, "humidity": 88}, "dt": 1760000000}).encode()
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def api():
+    StubWeatherAPI.latency = 0.0
+    StubWeatherAPI.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubWeatherAPI)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/weather"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def make_service(db_path):
+    services = []
+
+    def make(base_url, **kwargs):
+        kwargs.setdefault("session", weather.make_session(retries=0))
+        service = weather.WeatherService("test-key", base_url=base_url, timeout=(1, 0.3), db_path=db_path, **kwargs)
+        services.append(service)
+        return service
+
+    yield make
+    for service in services:
+        service.close()
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_repeat_lookups_within_ttl_are_served_from_memory(api, make_service):
+    service = make_service(api)
+    first = service.get("Kochi")
+    assert service.get(" kochi ") == first
+    assert first["description"] == "light rain" and first["temp"] == 27.5
+    assert StubWeatherAPI.requests == ["Kochi"]
+    assert (service.fetches, service.hits) == (1, 1)
+
+
+def test_stale_reading_is_served_while_one_refresh_runs(api, make_service):
+    service = make_service(api, ttl=0.05, stale_ttl=60)
+    first = service.get("Kochi")
+    time.sleep(0.1)
+    StubWeatherAPI.latency = 0.2
+    started = time.monotonic()
+    assert [service.get("Kochi") for _ in range(3)] == [first] * 3
+    assert time.monotonic() - started < 0.2
+    assert service.stale_hits == 3
+    wait_for(lambda: service.fetches == 2)
+    assert StubWeatherAPI.requests == ["Kochi", "Kochi"]
+
+
+def test_expired_reading_is_fetched_again(api, make_service):
+    service = make_service(api, ttl=0.01, stale_ttl=0.02)
+    service.get("Kochi")
+    time.sleep(0.05)
+    service.get("Kochi")
+    assert service.fetches == 2 and service.stale_hits == 0
+
+
+@pytest.mark.parametrize("city, message", [
+    ("Nowhere", "City not found"),
+    ("Garbled", "unexpected response"),
+    ("Slowtown", "Error fetching weather"),
+])
+def test_api_failures_raise_weather_error(api, make_service, city, message):
+    service = make_service(api)
+    with pytest.raises(weather.WeatherError, match=message):
+        service.get(city)
+
+
+def test_connection_refused_raises_weather_error(make_service):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    service = make_service(f"http://127.0.0.1:{port}/weather")
+    with pytest.raises(weather.WeatherError, match="Error fetching weather"):
+        service.get("Kochi")
+
+
+def test_fetch_many_runs_concurrently_and_maps_failures(api, make_service):
+    StubWeatherAPI.latency = 0.2
+    service = make_service(api)
+    cities = ["Kochi", "Thrissur", "Palakkad", "Nowhere"]
+    started = time.monotonic()
+    results = service.fetch_many(cities)
+    assert time.monotonic() - started < 0.6
+    assert list(results) == cities
+    assert all(results[city]["city"] == city for city in cities[:3])
+    assert isinstance(results["Nowhere"], weather.WeatherError)
+
+
+def test_observations_are_stored(api, make_service, db_path):
+    service = make_service(api, ttl=0, stale_ttl=0)
+    service.get("Kochi")
+    service.get("Kochi")
+    service.fetch_many(["Thrissur", "Nowhere"])
+    storage.flush(db_path)
+    with storage.connection(db_path) as conn:
+        rows = conn.execute(
+            "SELECT city, description, temp, humidity, observed_at FROM weather_observations ORDER BY id"
+        ).fetchall()
+    assert sorted(rows) == [("Kochi", "light rain", 27.5, 88, 1760000000)] * 2 + [
+        ("Thrissur", "light rain", 27.5, 88, 1760000000)]
@@ -0,0 +1,228 @@
+import hashlib
+import os
+import queue
+import re
+import threading
+import wave
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from telemetry import timed
+
+# ---------------------------
+# TEXT-TO-SPEECH WORKER
+# ---------------------------
+# pyttsx3 engines are not safe to drive from Streamlit reruns, so one daemon
+# thread owns the engine and renders speech to files. Clips are stored under a
+# hash of (text, language, voice rate) and replayed from disk when repeated.
+CACHE_DIR = ".tts_cache"
+MAX_CACHE_BYTES = 200 * 1024 * 1024
+RATE = 150
+
+LANGUAGE_CODES = {"English": "en", "Hindi": "hi", "Malayalam": "ml", "Telugu": "te"}
+
+_TOKEN = re.compile(r"[a-z]+")
+
+
+def cache_key(text, language, rate=RATE):
+    raw = "\x1f".join([text.strip(), language, str(rate)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def voice_languages(voice):
+    """Primary language subtags a pyttsx3 voice speaks, e.g. {"en"} for "en-US" or "TTS_MS_EN-US_ZIRA_11.0".
+
+    espeak lists tags such as b"\\x05en-gb" in `languages`; SAPI leaves them out,
+    so the last component of the voice ID is used instead. The whole ID is never
+    searched: every SAPI ID contains "HKEY_LOCAL_MACHINE" and "Tokens".
+    """
+    codes = set()
+    for tag in voice.languages or []:
+        if isinstance(tag, bytes):
+            tag = tag.decode("ascii", "ignore")
+        tokens = _TOKEN.findall(str(tag).lower())
+        if tokens:
+            codes.add(tokens[0])
+    name = re.split(r"[\\/]", str(voice.id))[-1].lower()
+    codes.update(token for token in _TOKEN.findall(name) if len(token) == 2)
+    return codes
+
+
+def clip_seconds(path):
+    """Playing time of a WAV file; 0 if it can't be read."""
+    try:
+        with wave.open(path, "rb") as clip:
+            return clip.getnframes() / clip.getframerate()
+    except (wave.Error, EOFError, OSError, ZeroDivisionError):
+        return 0.0
+
+
+def select_voice(engine, language):
+    """Switch `engine` to the first voice for `language`; the current voice stays if none matches."""
+    code = LANGUAGE_CODES.get(language, "en")
+    for voice in engine.getProperty("voices"):
+        if code in voice_languages(voice):
+            engine.setProperty("voice", voice.id)
+            return
+
+
+def _default_engine():
+    import pyttsx3
+    return pyttsx3.init()
+
+
+class TTSWorker:
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES, rate=RATE, engine_factory=_default_engine):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.rate = rate
+        self.engine_factory = engine_factory
+        self.hits = 0
+        self.renders = 0
+        self.error = None  # set if the speech engine could not start; every request then fails with it
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._files = OrderedDict()  # path -> size, least recently used first
+        self._total_bytes = 0
+        self._in_flight = {}
+        self._queue = queue.Queue()
+        self._load_index()
+        self._thread = threading.Thread(target=self._run, name="agrisense-tts", daemon=True)
+        self._thread.start()
+
+    @timed("tts.submit")
+    def submit(self, text, language="English"):
+        """Return a Future resolving to the audio file for `text`."""
+        key = cache_key(text, language, self.rate)
+        path = os.path.join(self.cache_dir, key + ".wav")
+        with self._lock:
+            if path in self._files:
+                self._touch(path)
+                self.hits += 1
+                future = Future()
+                future.set_result(path)
+                return future
+            if self.error is not None:
+                future = Future()
+                future.set_exception(self.error)
+                return future
+            if key in self._in_flight:
+                return self._in_flight[key]
+            future = Future()
+            self._in_flight[key] = future
+        self._queue.put((key, path, text, language, future))
+        return future
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def join(self, paths):
+        """Concatenate per-sentence WAV clips into one cached file; None if they can't be joined."""
+        if len(paths) == 1:
+            return paths[0]
+        key = hashlib.sha256("\x1f".join(paths).encode("utf-8")).hexdigest()
+        joined = os.path.join(self.cache_dir, f"joined-{key}.wav")
+        with self._lock:
+            if joined in self._files:
+                self._touch(joined)
+                return joined
+        try:
+            with wave.open(paths[0], "rb") as first:
+                params = first.getparams()
+            with wave.open(joined + ".part", "wb") as out:
+                out.setparams(params)
+                for path in paths:
+                    with wave.open(path, "rb") as clip:
+                        if clip.getparams()[:3] != params[:3]:
+                            raise wave.Error("mismatched clip format")
+                        out.writeframes(clip.readframes(clip.getnframes()))
+            os.replace(joined + ".part", joined)
+        except (wave.Error, EOFError, OSError):
+            return None
+        size = os.path.getsize(joined)
+        with self._lock:
+            self._files[joined] = size
+            self._total_bytes += size
+            self._evict()
+        return joined
+
+    def _load_index(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".wav") and not name.endswith(".part.wav"):
+                path = os.path.join(self.cache_dir, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, path, stat.st_size))
+        for _, path, size in sorted(entries):
+            self._files[path] = size
+            self._total_bytes += size
+
+    def _touch(self, path):
+        self._files.move_to_end(path)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and len(self._files) > 1:
+            path, size = self._files.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    @timed("tts.render")
+    def _render(self, engine, path, text, language):
+        # Keep the .wav suffix: some pyttsx3 drivers pick the output format from it.
+        tmp_path = path[:-len(".wav")] + ".part.wav"
+        select_voice(engine, language)
+        engine.save_to_file(text, tmp_path)
+        engine.runAndWait()
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            self._files[path] = size
+            self._total_bytes += size
+            self.renders += 1
+            self._evict()
+
+    def _run(self):
+        try:
+            engine = self.engine_factory()
+            engine.setProperty("rate", self.rate)
+        except Exception as e:
+            # e.g. no espeak on a server: fail what is queued now and everything submitted later.
+            with self._lock:
+                self.error = RuntimeError(f"Text-to-speech engine unavailable: {e}")
+                pending, self._in_flight = list(self._in_flight.values()), {}
+            for future in pending:
+                future.set_exception(self.error)
+            return
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            key, path, text, language, future = job
+            try:
+                self._render(engine, path, text, language)
+                future.set_result(path)
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    self._in_flight.pop(key, None)
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def get_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = TTSWorker()
+        return _worker
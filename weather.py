@@ -0,0 +1,157 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import storage
+from telemetry import timed
+
+# ---------------------------
+# WEATHER SERVICE
+# ---------------------------
+# One pooled HTTP session shared by every lookup, a per-city TTL cache that
+# serves stale readings while refreshing them in the background, and every
+# observation written to weather_observations for trend use.
+BASE_URL = "https://api.openweathermap.org/data/2.5/weather"
+TTL = 10 * 60
+STALE_TTL = 60 * 60
+TIMEOUT = (3.05, 5)
+RETRIES = 2
+MAX_WORKERS = 16
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS weather_observations
+    (id INTEGER PRIMARY KEY AUTOINCREMENT, city TEXT NOT NULL, description TEXT, temp REAL, humidity REAL,
+     observed_at INTEGER, fetched_at REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS idx_weather_observations_city ON weather_observations (city, fetched_at);
+"""
+
+
+class WeatherError(Exception):
+    pass
+
+
+def make_session(pool_size=MAX_WORKERS, retries=RETRIES):
+    retry = Retry(total=retries, connect=retries, read=retries, backoff_factor=0.3,
+                  status_forcelist=(429, 500, 502, 503, 504), allowed_methods=["GET"],
+                  respect_retry_after_header=True, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class WeatherService:
+    def __init__(self, api_key, base_url=BASE_URL, ttl=TTL, stale_ttl=STALE_TTL, timeout=TIMEOUT,
+                 max_workers=MAX_WORKERS, db_path=storage.DB_PATH, session=None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.timeout = timeout
+        self.db_path = db_path
+        self.session = session or make_session(max_workers)
+        self.hits = 0
+        self.stale_hits = 0
+        self.fetches = 0
+        self._cache = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="agrisense-weather")
+        with storage.connection(db_path) as conn:
+            conn.executescript(SCHEMA)
+
+    @timed("weather.get")
+    def get(self, city):
+        """Return the observation for `city`, serving cached or stale data when allowed."""
+        key = city.strip().lower()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                observation, fetched_at = entry
+                age = now - fetched_at
+                if age < self.ttl:
+                    self.hits += 1
+                    return observation
+                if age < self.stale_ttl:
+                    self.stale_hits += 1
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        self._pool.submit(self._refresh, city, key)
+                    return observation
+        return self._fetch(city, key)
+
+    def fetch_many(self, cities):
+        """Look up many cities concurrently; failures map to their WeatherError."""
+        def lookup(city):
+            try:
+                return self.get(city)
+            except WeatherError as e:
+                return e
+        return dict(zip(cities, self._pool.map(lookup, cities)))
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+        self.session.close()
+
+    def _refresh(self, city, key):
+        try:
+            self._fetch(city, key)
+        except WeatherError:
+            pass
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _fetch(self, city, key):
+        params = {"q": city, "appid": self.api_key, "units": "metric"}
+        try:
+            response = self.session.get(self.base_url, params=params, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise WeatherError(f"Error fetching weather: {str(e)}") from e
+        if response.status_code != 200:
+            raise WeatherError("City not found or API error.")
+        try:
+            data = response.json()
+            observation = {
+                "city": city,
+                "description": data["weather"][0]["description"],
+                "temp": data["main"]["temp"],
+                "humidity": data["main"]["humidity"],
+                "observed_at": data.get("dt"),
+            }
+        except (ValueError, KeyError, IndexError) as e:
+            raise WeatherError(f"Error fetching weather: unexpected response ({str(e)})") from e
+        fetched_at = time.time()
+        with self._lock:
+            self._cache[key] = (observation, time.monotonic())
+            self.fetches += 1
+        storage.writer(self.db_path).submit(
+            """INSERT INTO weather_observations (city, description, temp, humidity, observed_at, fetched_at)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            (city, observation["description"], observation["temp"], observation["humidity"],
+             observation["observed_at"], fetched_at),
+        )
+        return observation
+
+
+def format_weather(observation):
+    return (f"Weather in {observation['city']}: {observation['description']}, "
+            f"Temp: {observation['temp']}°C, Humidity: {observation['humidity']}%")
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_service(api_key):
+    global _service
+    with _service_lock:
+        if _service is None or _service.api_key != api_key:
+            _service = WeatherService(api_key)
+        return _service